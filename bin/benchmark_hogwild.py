@@ -0,0 +1,148 @@
+import argparse
+import os
+import time
+import numpy as np
+import pandas as pd
+import torch
+from tempfile import TemporaryDirectory
+from factslab.datastructures import DependencyTree
+from factslab.pytorch.childsumtreelstm import ChildSumDependencyTreeLSTM
+from factslab.pytorch.rnnregression import RNNRegressionTrainer
+from factslab.pytorch.checkpoint import list_checkpoints, load_checkpoint
+
+# initialize argument parser
+description = 'Compare convergence and throughput of single-process ' +\
+              'and hogwild training of a dependency tree LSTM regression.'
+parser = argparse.ArgumentParser(description=description)
+
+parser.add_argument('--trees',
+                    type=int,
+                    default=4000)
+parser.add_argument('--words',
+                    type=int,
+                    default=15,
+                    help='maximum number of nodes per tree')
+parser.add_argument('--vocab',
+                    type=int,
+                    default=1000)
+parser.add_argument('--size',
+                    type=int,
+                    default=50,
+                    help='embedding and hidden state size')
+parser.add_argument('--batch',
+                    type=int,
+                    default=32)
+parser.add_argument('--epochs',
+                    type=int,
+                    default=3)
+parser.add_argument('--workers',
+                    type=int,
+                    nargs='+',
+                    default=[2, 4, 8])
+parser.add_argument('--seed',
+                    type=int,
+                    default=0)
+
+
+def random_tree(size, vocab_size, rng):
+    """A random recursive dependency tree with size nodes"""
+    parent = [-1] + [rng.randint(0, k) for k in range(1, size)]
+    children = [[] for _ in range(size)]
+
+    for k in range(1, size):
+        children[parent[k]].append(k)
+
+    words = ['w' + str(w) for w in rng.randint(vocab_size, size=size)]
+    nodes = [None] * size
+
+    for k in reversed(range(size)):
+        if children[k]:
+            nodes[k] = DependencyTree(words[k],
+                                      [nodes[c] for c in children[k]])
+        else:
+            nodes[k] = words[k]
+
+    if isinstance(nodes[0], str):
+        return DependencyTree(nodes[0], [])
+
+    return nodes[0]
+
+
+def make_data(args, rng):
+    """Random trees whose target is a noisy mean of word weights"""
+    weights = rng.randn(args.vocab)
+
+    trees = [random_tree(rng.randint(2, args.words + 1), args.vocab, rng)
+             for _ in range(args.trees)]
+    targets = np.array([np.mean([weights[int(w[1:])] for w in t.words()])
+                        for t in trees])
+    targets += 0.1 * rng.randn(args.trees)
+
+    return trees, targets
+
+
+def test_mse(trainer, trees, targets):
+    return np.mean(np.square(trainer.predict(trees) - targets))
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(args.seed)
+
+    vocab = ['w' + str(i) for i in range(args.vocab)]
+    embeddings = pd.DataFrame(rng.randn(args.vocab, args.size),
+                              index=vocab)
+
+    trees, targets = make_data(args, rng)
+    test_trees, test_targets = make_data(args, rng)
+
+    X = [trees[i:i + args.batch] for i in range(0, len(trees), args.batch)]
+    Y = [targets[i:i + args.batch]
+         for i in range(0, len(targets), args.batch)]
+
+    curves = []
+
+    print('mode\t\tworkers\tseconds\ttrees/sec\ttest mse')
+
+    for workers in [1] + args.workers:
+        torch.manual_seed(args.seed)
+
+        trainer = RNNRegressionTrainer(
+            embeddings=embeddings, rnn_classes=ChildSumDependencyTreeLSTM,
+            rnn_hidden_sizes=args.size, epochs=args.epochs)
+
+        mode = 'baseline' if workers == 1 else 'hogwild'
+
+        # the first worker checkpoints the shared model at the end of
+        # each of its epochs; the modification times of the
+        # checkpoints give the wall-clock time of each epoch
+        steps_per_epoch = -(-len(X) // workers)
+
+        with TemporaryDirectory() as tmpdir:
+            start = time.time()
+            trainer.fit(X, Y, verbosity=0, workers=workers, hogwild=True,
+                        checkpoint_dir=tmpdir,
+                        checkpoint_every=steps_per_epoch,
+                        keep_checkpoints=args.epochs, lr=1e-3)
+            seconds = time.time() - start
+
+            mse = test_mse(trainer, test_trees, test_targets)
+
+            for epoch, path in enumerate(list_checkpoints(tmpdir), 1):
+                trainer._regression.load_state_dict(
+                    load_checkpoint(path)['model'])
+
+                curves.append((mode, workers, epoch,
+                               os.path.getmtime(path) - start,
+                               test_mse(trainer, test_trees, test_targets)))
+
+        print('{}\t{}\t{:.1f}\t{:.1f}\t\t{:.4f}'.format(
+            mode, workers, seconds, args.epochs * args.trees / seconds, mse))
+
+    # convergence: the test mse against wall-clock time, by epoch
+    print('\nmode\t\tworkers\tepoch\tseconds\ttest mse')
+
+    for mode, workers, epoch, seconds, mse in curves:
+        print('{}\t{}\t{}\t{:.1f}\t{:.4f}'.format(mode, workers, epoch,
+                                                 seconds, mse))
@@ -0,0 +1,95 @@
+import argparse
+import time
+import numpy as np
+import torch
+from factslab.pytorch.collate import flatten_sequences, pad_flat
+
+# initialize argument parser
+description = 'Compare row-by-row and vectorized padding of index ' +\
+              'sequences at increasing batch sizes.'
+parser = argparse.ArgumentParser(description=description)
+
+parser.add_argument('--batchsizes',
+                    type=int,
+                    nargs='+',
+                    default=[32, 128, 512, 1024, 2048, 4096])
+parser.add_argument('--maxlength',
+                    type=int,
+                    default=50)
+parser.add_argument('--vocab',
+                    type=int,
+                    default=50000)
+parser.add_argument('--device',
+                    type=str,
+                    default='cpu')
+parser.add_argument('--repeats',
+                    type=int,
+                    default=5)
+parser.add_argument('--seed',
+                    type=int,
+                    default=0)
+
+
+def pad_loop(data, targets, device):
+    """The row-by-row padding RNNRegression._pad_inputs used to do"""
+    seq_len = torch.from_numpy(np.array([len(x) for x in data]))
+    sorted_seq_len, sorted_idx = seq_len.sort(descending=True)
+    sorted_data = torch.zeros((len(data), sorted_seq_len[0]),
+                              dtype=torch.long, device=device)
+    sorted_targets = torch.zeros((len(targets),), dtype=torch.float,
+                                 device=device)
+
+    for m, x in enumerate(sorted_idx):
+        sorted_data[m][0:len(data[x])] = torch.tensor(data[x],
+                                                      dtype=torch.long)
+        sorted_targets[m] = targets[x]
+
+    # _get_inputs then copied the result once more
+    sorted_data = torch.tensor(sorted_data, dtype=torch.long, device=device)
+
+    return sorted_data, sorted_targets, sorted_seq_len
+
+
+def pad_vectorized(data, targets, device):
+    flat, offsets = flatten_sequences(data)
+    padded, lengths, order = pad_flat(flat, offsets, device)
+    targets = torch.as_tensor(targets, dtype=torch.float,
+                              device=device)[order.to(device)]
+
+    return padded, targets, lengths
+
+
+def time_it(pad, data, targets, device, repeats):
+    times = []
+
+    for _ in range(repeats):
+        start = time.perf_counter()
+        pad(data, targets, device)
+
+        if device.type == 'cuda':
+            torch.cuda.synchronize()
+
+        times.append(time.perf_counter() - start)
+
+    return min(times)
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(args.seed)
+    device = torch.device(args.device)
+
+    print('batch\tloop (ms)\tvectorized (ms)\tspeedup')
+
+    for batch_size in args.batchsizes:
+        lengths = rng.randint(1, args.maxlength + 1, size=batch_size)
+        data = [list(rng.randint(args.vocab, size=n)) for n in lengths]
+        targets = list(rng.randn(batch_size))
+
+        loop = time_it(pad_loop, data, targets, device, args.repeats)
+        vectorized = time_it(pad_vectorized, data, targets, device,
+                             args.repeats)
+
+        print('{}\t{:.2f}\t\t{:.2f}\t\t{:.1f}x'.format(
+            batch_size, 1000 * loop, 1000 * vectorized, loop / vectorized))
@@ -0,0 +1,106 @@
+import argparse
+import time
+import numpy as np
+import pandas as pd
+import torch
+from torch.nn import LSTM
+from factslab.pytorch.rnnregression import RNNRegressionTrainer
+from factslab.pytorch.dataset import prefetch
+
+# initialize argument parser
+description = 'Compare RNNRegressionTrainer throughput with and without ' +\
+              'background batch preparation.'
+parser = argparse.ArgumentParser(description=description)
+
+parser.add_argument('--sentences',
+                    type=int,
+                    default=20000)
+parser.add_argument('--batch',
+                    type=int,
+                    default=128)
+parser.add_argument('--maxlength',
+                    type=int,
+                    default=40)
+parser.add_argument('--vocab',
+                    type=int,
+                    default=20000)
+parser.add_argument('--size',
+                    type=int,
+                    default=100,
+                    help='embedding and hidden state size')
+parser.add_argument('--depths',
+                    type=int,
+                    nargs='+',
+                    default=[0, 1, 2, 4])
+parser.add_argument('--device',
+                    type=str,
+                    default='cpu')
+parser.add_argument('--seed',
+                    type=int,
+                    default=0)
+
+
+def time_epoch(trainer, X, Y, depth):
+    """The seconds one training epoch takes, without the setup
+
+    The model, optimizer, and dataset are built first, as in fit, and
+    only the loop over the batches is timed.
+    """
+    trainer._set_training_data(X, Y)
+    trainer._initialize_trainer_regression()
+
+    optimizer = torch.optim.Adam(trainer._regression.parameters())
+    dataset, batches = trainer._index_batches(X, Y)
+
+    prepared = (trainer._prepare_batch(dataset, batch_idx)
+                for batch_idx in batches)
+
+    start = time.perf_counter()
+
+    for batch, targs in prefetch(prepared, depth):
+        optimizer.zero_grad()
+
+        predicted, targs = trainer._regression(batch, targs)
+        loss = trainer._batch_loss(predicted, targs)
+        loss.backward()
+
+        optimizer.step()
+
+    if trainer.device.type == 'cuda':
+        torch.cuda.synchronize()
+
+    return time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(args.seed)
+    device = torch.device(args.device)
+
+    vocab = ['w' + str(i) for i in range(args.vocab)]
+    embeddings = pd.DataFrame(rng.randn(args.vocab, args.size),
+                              index=vocab)
+
+    sentences = [[vocab[i] for i in rng.randint(args.vocab, size=n)]
+                 for n in rng.randint(1, args.maxlength + 1,
+                                      size=args.sentences)]
+    targets = rng.randn(args.sentences)
+
+    X = [sentences[i:i + args.batch]
+         for i in range(0, args.sentences, args.batch)]
+    Y = [targets[i:i + args.batch]
+         for i in range(0, args.sentences, args.batch)]
+
+    print('prefetch depth\tbatches/sec')
+
+    for depth in args.depths:
+        torch.manual_seed(args.seed)
+
+        trainer = RNNRegressionTrainer(embeddings=embeddings, device=device,
+                                       rnn_classes=LSTM, epochs=1,
+                                       rnn_hidden_sizes=args.size)
+
+        seconds = time_epoch(trainer, X, Y, depth)
+
+        print('{}\t\t{:.2f}'.format(depth, len(X) / seconds))
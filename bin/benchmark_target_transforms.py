@@ -0,0 +1,87 @@
+import argparse
+import time
+import numpy as np
+import pandas as pd
+from factslab.utility import ridit, logit_ridit, zscore
+
+# initialize argument parser
+description = 'Compare grouped ridit, logit ridit, and z-score ' +\
+              'transforms with their per-group Python callback versions.'
+parser = argparse.ArgumentParser(description=description)
+
+parser.add_argument('--rows',
+                    type=int,
+                    default=10000000)
+parser.add_argument('--groups',
+                    type=int,
+                    default=100000,
+                    help='number of participants')
+parser.add_argument('--levels',
+                    type=int,
+                    default=7,
+                    help='number of points on the response scale')
+parser.add_argument('--nocallback',
+                    action='store_true',
+                    help='skip the callback versions, which are slow ' +
+                         'on large tables')
+parser.add_argument('--seed',
+                    type=int,
+                    default=0)
+
+
+def callback_ridit(scores, groups):
+    return scores.groupby(groups).transform(lambda x: x.rank() /
+                                            (len(x) + 1.))
+
+
+def callback_logit_ridit(scores, groups):
+    r = callback_ridit(scores, groups)
+
+    return np.log(r) - np.log(1. - r)
+
+
+def callback_zscore(scores, groups):
+    return scores.groupby(groups).transform(lambda x: (x - x.mean()) /
+                                            x.std())
+
+
+def timed(transform, scores, groups):
+    start = time.perf_counter()
+    result = transform(scores, groups)
+
+    return result, time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(args.seed)
+
+    data = pd.DataFrame({'participant': rng.randint(args.groups,
+                                                    size=args.rows),
+                         'response': rng.randint(1, args.levels + 1,
+                                                 size=args.rows)})
+
+    transforms = [('ridit', ridit, callback_ridit),
+                  ('logit ridit', logit_ridit, callback_logit_ridit),
+                  ('z-score', zscore, callback_zscore)]
+
+    print('transform\tvectorized sec\tcallback sec\tspeedup')
+
+    for name, vectorized, callback in transforms:
+        result, seconds = timed(vectorized, data.response, data.participant)
+
+        if args.nocallback:
+            print('{}\t{:.2f}'.format(name.ljust(11), seconds))
+            continue
+
+        expected, callback_seconds = timed(callback, data.response,
+                                           data.participant)
+
+        if not np.allclose(result, expected, equal_nan=True):
+            msg = name + ' differs from its callback version'
+            raise ValueError(msg)
+
+        print('{}\t{:.2f}\t\t{:.2f}\t\t{:.1f}'.format(
+            name.ljust(11), seconds, callback_seconds,
+            callback_seconds / seconds))
@@ -0,0 +1,87 @@
+import argparse
+import time
+import numpy as np
+from factslab.datastructures import ConstituencyTree, DependencyTree
+
+# initialize argument parser
+description = 'Compare scanning and indexed child/parent lookups on ' +\
+              'random trees with thousands of nodes.'
+parser = argparse.ArgumentParser(description=description)
+
+parser.add_argument('--sizes',
+                    type=int,
+                    nargs='+',
+                    default=[250, 500, 1000, 2000, 4000, 8000])
+parser.add_argument('--seed',
+                    type=int,
+                    default=0)
+
+
+def random_tree(tree_class, size, rng):
+    """Build a random recursive tree with size nodes
+
+    Each node after the first attaches to a uniformly chosen earlier
+    node; nodes without children become leaves (strings)
+    """
+    parent = [-1] + [rng.randint(0, k) for k in range(1, size)]
+    children = [[] for _ in range(size)]
+
+    for k in range(1, size):
+        children[parent[k]].append(k)
+
+    nodes = [None] * size
+
+    for k in reversed(range(size)):
+        if children[k]:
+            nodes[k] = tree_class('n' + str(k),
+                                  [nodes[c] for c in children[k]])
+        else:
+            nodes[k] = 'w' + str(k)
+
+    return nodes[0]
+
+
+def scan_lookups(tree):
+    """All child and parent lookups by scanning the positions, as the
+    tree classes used to do"""
+    positions = tree.treepositions()
+
+    for idx in positions:
+        [i for i in positions
+         if len(i) == len(idx) + 1 and i[:len(idx)] == idx]
+        [idx[:-1]] if idx else []
+
+
+def indexed_lookups(tree):
+    """All child and parent lookups through the index (including the
+    time to build it)"""
+    tree.reindex()
+
+    for idx in tree.positions:
+        tree.children_idx(idx)
+        tree.parents_idx(idx)
+
+
+def time_it(f, tree):
+    start = time.perf_counter()
+    f(tree)
+
+    return time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(args.seed)
+
+    print('class\t\t\tnodes\tscan (s)\tindexed (s)\tspeedup')
+
+    for tree_class in [ConstituencyTree, DependencyTree]:
+        for size in args.sizes:
+            tree = random_tree(tree_class, size, rng)
+
+            scan = time_it(scan_lookups, tree)
+            indexed = time_it(indexed_lookups, tree)
+
+            print('{}\t{}\t{:.4f}\t\t{:.4f}\t\t{:.1f}x'.format(
+                tree_class.__name__, size, scan, indexed, scan / indexed))
@@ -0,0 +1,118 @@
+import argparse
+import gc
+import pickle
+import time
+import tracemalloc
+import numpy as np
+from factslab.datastructures import ConstituencyTree, DependencyTree
+from factslab.datastructures import CompactTree, Vocabulary
+
+# initialize argument parser
+description = 'Compare memory and pickling cost per tree of the nltk ' +\
+              'based trees and CompactTree.'
+parser = argparse.ArgumentParser(description=description)
+
+parser.add_argument('--trees',
+                    type=int,
+                    default=2000)
+parser.add_argument('--words',
+                    type=int,
+                    default=25,
+                    help='number of words per tree')
+parser.add_argument('--vocab',
+                    type=int,
+                    default=5000)
+parser.add_argument('--seed',
+                    type=int,
+                    default=0)
+
+
+def random_bracketing(num_words, vocab_size, dependency, rng):
+    """A random tree over num_words words in bracketed notation
+
+    Adjacent constituents are merged at random until one is left; for
+    dependency trees the label of each merged node is a word
+    """
+    def word():
+        return 'w' + str(rng.randint(vocab_size))
+
+    if dependency:
+        items = [word() for _ in range(num_words)]
+    else:
+        items = ['(T{} {})'.format(rng.randint(40), word())
+                 for _ in range(num_words)]
+
+    while len(items) > 1:
+        i = rng.randint(len(items))
+        j = min(len(items), i + rng.randint(2, 4))
+
+        label = word() if dependency else 'X' + str(rng.randint(20))
+        items[i:j] = ['({} {})'.format(label, ' '.join(items[i:j]))]
+
+    return items[0] if items[0].startswith('(') else '(w0 ' + items[0] + ')'
+
+
+def measure(build):
+    """The bytes allocated by build, and its result"""
+    gc.collect()
+    tracemalloc.start()
+
+    result = build()
+
+    gc.collect()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return size, result
+
+
+def build_nltk(tree_class, strings):
+    def build():
+        trees = [tree_class.fromstring(s) for s in strings]
+
+        # the tree LSTMs always need the index
+        for tree in trees:
+            tree.positions
+
+        return trees
+
+    return build
+
+
+def build_compact(tree_class, strings):
+    token_vocab, label_vocab = Vocabulary(), Vocabulary()
+
+    def build():
+        return [CompactTree.from_tree(tree_class.fromstring(s),
+                                      token_vocab, label_vocab)
+                for s in strings]
+
+    return build
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(args.seed)
+
+    print('class\t\t\trepresentation\tbytes/tree\tpickled bytes/tree' +
+          '\tpickle+unpickle (ms/1000 trees)')
+
+    for tree_class in [ConstituencyTree, DependencyTree]:
+        dependency = tree_class is DependencyTree
+        strings = [random_bracketing(args.words, args.vocab, dependency, rng)
+                   for _ in range(args.trees)]
+
+        for name, build in [('nltk', build_nltk(tree_class, strings)),
+                            ('compact', build_compact(tree_class, strings))]:
+            size, trees = measure(build)
+
+            start = time.perf_counter()
+            pickled = pickle.dumps(trees, protocol=pickle.HIGHEST_PROTOCOL)
+            pickle.loads(pickled)
+            seconds = time.perf_counter() - start
+
+            print('{}\t{}\t\t{:.0f}\t\t{:.0f}\t\t\t{:.1f}'.format(
+                tree_class.__name__, name,
+                size / args.trees, len(pickled) / args.trees,
+                1000 * 1000 * seconds / args.trees))
@@ -0,0 +1,179 @@
+import argparse
+import sys
+import time
+import numpy as np
+import torch
+from factslab.pytorch.childsumtreelstm import ChildSumDependencyTreeLSTM
+
+# initialize argument parser
+description = 'Compare recursive and iterative node scheduling in ' +\
+              'ChildSumTreeLSTM on synthetic trees of increasing depth.'
+parser = argparse.ArgumentParser(description=description)
+
+parser.add_argument('--depths',
+                    type=int,
+                    nargs='+',
+                    default=[10, 50, 100, 250, 500, 1000, 2000])
+parser.add_argument('--branching',
+                    type=int,
+                    default=2,
+                    help='maximum number of extra leaves per spine node')
+parser.add_argument('--size',
+                    type=int,
+                    default=50,
+                    help='input and hidden state size')
+parser.add_argument('--repeats',
+                    type=int,
+                    default=3)
+parser.add_argument('--seed',
+                    type=int,
+                    default=0)
+
+
+class SyntheticTree(object):
+    """A tree with a spine of a given depth and random extra leaves
+
+    Implements the interface ChildSumDependencyTreeLSTM needs, with
+    integer positions, so that very deep trees can be built without
+    nltk's recursive position computation
+    """
+
+    def __init__(self, depth, branching, rng):
+        self.parent = [-1]
+        spine = 0
+
+        for d in range(1, depth):
+            for _ in range(rng.randint(0, branching + 1)):
+                self.parent.append(spine)
+
+            self.parent.append(spine)
+            spine = len(self.parent) - 1
+
+        self.children = [[] for _ in self.parent]
+
+        for k, p in enumerate(self.parent):
+            if p >= 0:
+                self.children[p].append(k)
+
+        self.positions = list(range(len(self.parent)))
+
+    def root_idx(self):
+        return [0]
+
+    def children_idx(self, idx):
+        return self.children[idx]
+
+    def parents_idx(self, idx):
+        return [self.parent[idx]] if self.parent[idx] >= 0 else []
+
+    def words(self):
+        return self.positions
+
+    def word_index(self, idx):
+        return idx
+
+
+class RecursiveDependencyTreeLSTM(ChildSumDependencyTreeLSTM):
+    """The node-at-a-time traversal as it was before the scheduler:
+    each node recursively computes the nodes it depends on"""
+
+    def _run_nodes(self, layer, direction, x, plan):
+        if direction == 'up':
+            previous = plan.children()
+        else:
+            previous = plan.parents()
+
+        self.hidden_state = [None] * plan.num_nodes
+        self.cell_state = [None] * plan.num_nodes
+
+        for k in range(plan.num_nodes):
+            self._visit(layer, direction, x, previous, k)
+
+        return torch.stack(self.hidden_state)
+
+    def _visit(self, layer, direction, x, previous, k):
+        if self.hidden_state[k] is None:
+            for i in previous[k]:
+                self._visit(layer, direction, x, previous, i)
+
+            self._upward_downward(layer, direction, x, previous, k)
+
+
+def depth_of(tree):
+    depth = 0
+
+    for k in tree.positions:
+        d, p = 1, tree.parent[k]
+
+        while p >= 0:
+            d, p = d + 1, tree.parent[p]
+
+        depth = max(depth, d)
+
+    return depth
+
+
+def time_forward_backward(lstm, inputs, tree, repeats):
+    # the first call compiles and caches the plan
+    lstm(inputs, tree)
+
+    times = []
+
+    for _ in range(repeats):
+        lstm.zero_grad()
+
+        start = time.perf_counter()
+        hidden_all, hidden_final = lstm(inputs, tree)
+        hidden_final.sum().backward()
+        times.append(time.perf_counter() - start)
+
+    return min(times)
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(args.seed)
+    torch.manual_seed(args.seed)
+
+    lstms = [('recursive', RecursiveDependencyTreeLSTM(
+                  input_size=args.size, hidden_size=args.size,
+                  bidirectional=True, execution='node')),
+             ('iterative', ChildSumDependencyTreeLSTM(
+                  input_size=args.size, hidden_size=args.size,
+                  bidirectional=True, execution='node')),
+             ('level', ChildSumDependencyTreeLSTM(
+                  input_size=args.size, hidden_size=args.size,
+                  bidirectional=True, execution='level'))]
+
+    for name, lstm in lstms[1:]:
+        lstm.load_state_dict(lstms[0][1].state_dict())
+
+    print('depth\tnodes\t' + '\t'.join([n + ' (s)' for n, _ in lstms]))
+
+    for depth in args.depths:
+        tree = SyntheticTree(depth, args.branching, rng)
+        inputs = torch.randn(len(tree.positions), args.size)
+
+        assert depth_of(tree) == depth
+
+        row = [str(depth), str(len(tree.positions))]
+
+        for name, lstm in lstms:
+            limit = sys.getrecursionlimit()
+
+            if name == 'recursive':
+                # one frame per level, plus headroom; without this the
+                # recursive traversal fails on the deeper trees
+                sys.setrecursionlimit(max(limit, 4 * depth + 1000))
+
+            try:
+                seconds = time_forward_backward(lstm, inputs, tree,
+                                                args.repeats)
+                row.append('{:.4f}'.format(seconds))
+            except RecursionError:
+                row.append('RecursionError')
+            finally:
+                sys.setrecursionlimit(limit)
+
+        print('\t'.join(row))
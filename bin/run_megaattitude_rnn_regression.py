@@ -1,15 +1,19 @@
 import argparse
+import hashlib
+import os
 import numpy as np
 import pandas as pd
 import pdb
 from torch.nn import LSTM
 from torch.cuda import is_available
 from torch import device
-from factslab.utility import load_glove_embedding
-from factslab.datastructures import ConstituencyTree
+from factslab.utility import load_glove_embedding, logit_ridit
+from factslab.datastructures import ConstituencyTree, CompactTree, Vocabulary
+from factslab.datastructures import pack_compact_trees, unpack_compact_trees
 from factslab.pytorch.childsumtreelstm import ChildSumConstituencyTreeLSTM
 from factslab.pytorch.rnnregression import RNNRegressionTrainer
 import sys
+import time
 
 # initialize argument parser
 description = 'Run an RNN regression on MegaAttitude.'
@@ -25,6 +29,13 @@ parser.add_argument('--structures',
 parser.add_argument('--embeddings',
                     type=str,
                     default='../../../embeddings/glove/glove.42B.300d')
+parser.add_argument('--cachedir',
+                    type=str,
+                    default='.',
+                    help='where to keep the preprocessed data')
+parser.add_argument('--preprocess',
+                    action='store_true',
+                    help='only write the preprocessed data')
 parser.add_argument('--regressiontype',
                     type=str,
                     default="linear")
@@ -34,95 +45,319 @@ parser.add_argument('--epochs',
 parser.add_argument('--batch',
                     type=int,
                     default=128)
+parser.add_argument('--maxtokens',
+                    type=int,
+                    default=None,
+                    help='batch sentences of similar length with this ' +
+                         'token budget instead of chunks of --batch ' +
+                         '(linear only)')
 parser.add_argument('--rnntype',
                     type=str,
                     default="tree")
 parser.add_argument('--verbosity',
                     type=int,
                     default="1")
+parser.add_argument('--workers',
+                    type=int,
+                    default=1,
+                    help='number of data-parallel training processes')
+parser.add_argument('--scaling',
+                    action='store_true',
+                    help='train with 1, 2, 4, ..., --workers processes ' +
+                         'and report the scaling efficiency')
 parser.add_argument('--attention',
                     action='store_true',
                     help='Turn attention on or off')
 
-# parse arguments
-args = parser.parse_args()
 
-data = pd.read_csv(args.data)
+def train(x, y, embeddings, rnn_class, args, device_to_use, workers):
+    """Train one RNN regression and time it
+
+    Parameters
+    ----------
+    x, y
+        the minibatches of structures and targets (or the structures
+        and targets themselves if args.maxtokens is given)
+    embeddings : pandas.DataFrame
+    rnn_class : type
+    args : argparse.Namespace
+        the parsed arguments
+    device_to_use : torch.device
+    workers : int
+        the number of data-parallel training processes
+
+    Returns
+    -------
+    trainer : RNNRegressionTrainer
+    seconds : float
+        how long fit took
+    """
+    trainer = RNNRegressionTrainer(embeddings=embeddings,
+                                   device=device_to_use,
+                                   rnn_classes=rnn_class, bidirectional=True,
+                                   attention=args.attention,
+                                   epochs=args.epochs,
+                                   regression_type=args.regressiontype,
+                                   rnn_hidden_sizes=300, num_rnn_layers=1,
+                                   regression_hidden_sizes=(150,))
+
+    start = time.perf_counter()
+    trainer.fit(X=x, Y=y, lr=1e-2, verbosity=args.verbosity,
+                max_tokens=args.maxtokens, workers=workers)
+
+    return trainer, time.perf_counter() - start
+
+
+# bump whenever preprocess or the artifact layout changes, so that
+# stale artifacts are not reused
+ARTIFACT_VERSION = 1
+
+
+def load_data(args):
+    """Load the responses, the structures, and the embeddings
+
+    The first run preprocesses the data and writes it to an artifact in
+    args.cachedir (see artifact_path); later runs with the same inputs
+    only load the artifact.
+
+    Returns
+    -------
+    data : pandas.DataFrame
+        one row per response, with its condition, the response as a
+        class (from 0) in multinomial, and its logit ridit score by
+        participant in logit_ridit
+    structures : dict(str, CompactTree)
+        the tree of each condition
+    embeddings : pandas.DataFrame
+        the GloVe vectors of the words in the structures
+    """
+    path = artifact_path(args)
+
+    if not os.path.exists(path):
+        save_artifact(path, *preprocess(args))
+
+    return load_artifact(path)
+
+
+def artifact_path(args):
+    """The path of the preprocessed data for args
+
+    The name holds ARTIFACT_VERSION and a hash of the contents of the
+    responses and structures and of the name and size of the
+    embeddings, so changing any of them makes a new artifact.
+    """
+    digest = hashlib.sha256(str(ARTIFACT_VERSION).encode())
+
+    for fpath in [args.data, args.structures]:
+        with open(fpath, 'rb') as f:
+            for block in iter(lambda: f.read(2 ** 20), b''):
+                digest.update(block)
+
+    # the embeddings are too large to hash on every run
+    digest.update(os.path.basename(args.embeddings).encode())
+
+    if os.path.exists(args.embeddings + '.zip'):
+        digest.update(str(os.path.getsize(args.embeddings + '.zip')).encode())
+
+    name = 'megaattitude-v{}-{}.npz'.format(ARTIFACT_VERSION,
+                                            digest.hexdigest()[:16])
+
+    return os.path.join(args.cachedir, name)
+
+
+def save_artifact(path, data, structures, embeddings):
+    """Write the output of preprocess as flat arrays
+
+    The trees are packed into one set of node arrays whose token ids
+    are the rows of the embedding matrix, and each response is stored
+    as the index of its condition and its targets.
+    """
+    conditions = list(structures.keys())
+    position = {c: i for i, c in enumerate(conditions)}
+    trees = [structures[c] for c in conditions]
+
+    token_strings = trees[0].token_vocab.strings
+    matrix = embeddings.loc[token_strings].values.astype(np.float32)
+
+    arrays = pack_compact_trees(trees)
+    arrays.update(version=np.array(ARTIFACT_VERSION),
+                  conditions=np.array(conditions, dtype=str),
+                  condition=data.condition.map(position).values,
+                  multinomial=data.multinomial.values,
+                  logit_ridit=data.logit_ridit.values,
+                  embeddings=matrix)
 
-# remove subjects that are marked for exclusion
-data = data[~data.exclude]
+    # written under a temporary name, so an interrupted run leaves no
+    # partial artifact behind
+    tmppath = path + '.tmp.npz'
+    np.savez(tmppath, **arrays)
+    os.replace(tmppath, path)
 
-# remove null responses; removes 10 lines
-data = data[~data.response.isnull()]
 
-# the intransitive frame is denoted by an empty string, so make it overt
-data.loc[data.frame.isnull(), 'frame'] = 'null'
+def load_artifact(path):
+    """Read the data, structures, and embeddings written by save_artifact"""
+    with np.load(path) as arrays:
+        arrays = dict(arrays)
+
+    if arrays['version'] != ARTIFACT_VERSION:
+        msg = path + ' was written by another version of preprocess'
+        raise ValueError(msg)
+
+    conditions = arrays['conditions'].tolist()
+    trees = unpack_compact_trees(arrays)
+    structures = dict(zip(conditions, trees))
+
+    condition = arrays['conditions'][arrays['condition']]
+    data = pd.DataFrame({'condition': condition,
+                         'multinomial': arrays['multinomial'],
+                         'logit_ridit': arrays['logit_ridit']})
+
+    embeddings = pd.DataFrame(arrays['embeddings'].astype(float),
+                              index=trees[0].token_vocab.strings)
+
+    return data, structures, embeddings
+
+
+def preprocess(args):
+    """Read and transform the raw responses, structures, and embeddings
+
+    Returns
+    -------
+    data, structures, embeddings
+        as for load_data
+    """
+    data = pd.read_csv(args.data)
+
+    # remove subjects that are marked for exclusion
+    data = data[~data.exclude]
+
+    # remove null responses; removes 10 lines
+    data = data[~data.response.isnull()]
+
+    # the intransitive frame is denoted by an empty string, so make it overt
+    data.loc[data.frame.isnull(), 'frame'] = 'null'
 
-if args.regressiontype == "multinomial":
     # make smallest response value 0
-    data['response'] = data.response.astype(int) - 1
+    data['multinomial'] = data.response.astype(int) - 1
 
-else:
     # convert responses to logit ridit scores
-    data['response'] = data.groupby('participant').response.apply(lambda x: x.rank() / (len(x) + 1.))
-    data['response'] = np.log(data.response) - np.log(1. - data.response)
+    data['logit_ridit'] = logit_ridit(data.response, data.participant)
+
+    # convert "email" to "e-mail" to deal with differences between
+    # megaattitude_v1.csv and structures.tsv
+    data['condition'] = data.verb.replace('email', 'e-mail') + '-' + data.frame + '-' + data.voice
+
+    # load structures into a dictionary
+    with open(args.structures) as f:
+        structures = dict([line.replace(',', 'COMMA').strip().split('\t') for line in f])
+
+        structures = {k: ConstituencyTree.fromstring(s) for k, s in structures.items()}
+
+    for s in structures.values():
+        s.collapse_unary(True, True)
 
-# convert "email" to "e-mail" to deal with differences between
-# megaattitude_v1.csv and structures.tsv
-data['condition'] = data.verb.replace('email', 'e-mail') + '-' + data.frame + '-' + data.voice
+    # every tree shares one vocabulary of words
+    token_vocab, label_vocab = Vocabulary(), Vocabulary()
+    structures = {k: CompactTree.from_tree(s, token_vocab, label_vocab)
+                  for k, s in structures.items()}
 
-# load structures into a dictionary
-with open(args.structures) as f:
-    structures = dict([line.replace(',', 'COMMA').strip().split('\t') for line in f])
+    # get the structure IDs from the dictionary keys
+    conditions = list(structures.keys())
 
-    structures = {k: ConstituencyTree.fromstring(s) for k, s in structures.items()}
+    # filter down to those conditions found in conditions
+    data = data[data.condition.isin(conditions)]
 
-for s in structures.values():
-    s.collapse_unary(True, True)
+    # load the glove embedding
+    embeddings = load_glove_embedding(args.embeddings, token_vocab.strings,
+                                      cache_dir=args.cachedir)
 
-# get the structure IDs from the dictionary keys
-conditions = list(structures.keys())
+    return data, structures, embeddings
 
-# filter down to those conditions found in conditions
-data = data[data.condition.isin(conditions)]
 
-# build the vocab list up from the structures
-vocab = list({word
-              for tree in structures.values()
-              for word in tree.leaves()})
+def inputs_and_targets(data, structures, rnntype, regressiontype):
+    """The structures and targets to train on, and the RNN class
 
-# load the glove embedding
-embeddings = load_glove_embedding(args.embeddings, vocab)
-device_to_use = device("cuda:0" if is_available() else "cpu")
+    Parameters
+    ----------
+    data, structures
+        as returned by load_data
+    rnntype : str
+        "tree" or "linear"
+    regressiontype : str
+        the regression type of RNNRegressionTrainer
+
+    Returns
+    -------
+    x_raw : list
+        the tree of each response; its token ids are the rows of the
+        embeddings, so the trainer does not look up its words, and a
+        linear-chain RNN runs over its words in order
+    y_raw : numpy.array
+        the target of each response
+    rnn_class : type
+    """
+    if regressiontype == "multinomial":
+        y_raw = data.multinomial.values
+    else:
+        y_raw = data.logit_ridit.values
+
+    if rnntype == "tree":
+        rnn_class = ChildSumConstituencyTreeLSTM
+    elif rnntype == "linear":
+        rnn_class = LSTM
+    else:
+        msg = 'rnntype must be tree or linear'
+        raise ValueError(msg)
 
-if args.rnntype == "tree":
     x_raw = [structures[c] for c in data.condition.values]
-    x = [x_raw[i:i + args.batch] for i in range(0, len(x_raw), args.batch)]
-    y_raw = data.response.values
-    y = [y_raw[i:i + args.batch] for i in range(0, len(y_raw), args.batch)]
-    rnntype = ChildSumConstituencyTreeLSTM
-    args.batch = 1
-elif args.rnntype == "linear":
-    # Implmenent mini-batching
-    x_raw = [structures[c].words() for c in data.condition.values]
-    x = [x_raw[i:i + args.batch] for i in range(0, len(x_raw), args.batch)]
-    y_raw = data.response.values
-    y = [y_raw[i:i + args.batch] for i in range(0, len(y_raw), args.batch)]
-    rnntype = LSTM
-    # Take care of the fact that the last batch doesn't have size 128. This
-    # casues problems in attention
-    x[-1] = x[-1] + x[-2][0:len(x[-2]) - len(x[-1])]
-    y[-1] = np.append(y[-1], y[-2][0:len(y[-2]) - len(y[-1])])
-else:
-    sys.exit('Error. Argument rnntype must be tree or linear')
-
-# train the model
-trainer = RNNRegressionTrainer(embeddings=embeddings, device=device_to_use,
-                               rnn_classes=rnntype, bidirectional=True,
-                               attention=args.attention, epochs=args.epochs,
-                               regression_type=args.regressiontype,
-                               rnn_hidden_sizes=300, num_rnn_layers=1,
-                               regression_hidden_sizes=(150,),
-                               batch_size=args.batch)
-
-trainer.fit(X=x, Y=y, lr=1e-2, verbosity=args.verbosity)
+
+    return x_raw, y_raw, rnn_class
+
+
+# everything else runs only in the main process, so that the processes
+# spawned for --workers do not reload the data
+if __name__ == '__main__':
+    # parse arguments
+    args = parser.parse_args()
+
+    data, structures, embeddings = load_data(args)
+
+    if args.preprocess:
+        sys.exit()
+
+    device_to_use = device("cuda:0" if is_available() else "cpu")
+
+    try:
+        x_raw, y_raw, rnntype = inputs_and_targets(data, structures,
+                                                   args.rnntype,
+                                                   args.regressiontype)
+    except ValueError:
+        sys.exit('Error. Argument rnntype must be tree or linear')
+
+    if args.maxtokens is not None and rnntype == LSTM:
+        # the trainer forms the batches itself
+        x, y = x_raw, y_raw
+    else:
+        args.maxtokens = None
+
+        # Implmenent mini-batching
+        x = [x_raw[i:i + args.batch] for i in range(0, len(x_raw), args.batch)]
+        y = [y_raw[i:i + args.batch] for i in range(0, len(y_raw), args.batch)]
+
+    # train the model
+    if args.scaling:
+        counts = [2 ** i for i in range(args.workers.bit_length())
+                  if 2 ** i <= args.workers]
+        seconds = [train(x, y, embeddings, rnntype, args, device_to_use,
+                         n)[1]
+                   for n in counts]
+
+        print('workers\tseconds\tspeedup\tefficiency')
+
+        for n, t in zip(counts, seconds):
+            print('{}\t{:.1f}\t{:.2f}\t{:.2f}'.format(
+                n, t, seconds[0] / t, seconds[0] / (n * t)))
+    else:
+        trainer, seconds = train(x, y, embeddings, rnntype, args,
+                                 device_to_use, args.workers)
+        print('training took {:.1f} seconds'.format(seconds))
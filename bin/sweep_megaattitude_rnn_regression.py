@@ -0,0 +1,224 @@
+import argparse
+import itertools
+import multiprocessing
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+import torch
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from factslab.pytorch.rnnregression import RNNRegressionTrainer
+from run_megaattitude_rnn_regression import load_data, inputs_and_targets
+
+# initialize argument parser
+description = 'Sweep RNN regression configurations on MegaAttitude.'
+parser = argparse.ArgumentParser(description=description)
+
+# file handling
+parser.add_argument('--data',
+                    type=str,
+                    default='../../factslab-data/megaattitude/megaattitude_v1.csv')
+parser.add_argument('--structures',
+                    type=str,
+                    default='../../factslab-data/megaattitude/structures.tsv')
+parser.add_argument('--embeddings',
+                    type=str,
+                    default='../../../embeddings/glove/glove.42B.300d')
+parser.add_argument('--cachedir',
+                    type=str,
+                    default='.',
+                    help='where to keep the preprocessed data')
+parser.add_argument('--output',
+                    type=str,
+                    default='megaattitude_sweep.tsv')
+
+# the search space
+parser.add_argument('--rnntypes',
+                    type=str,
+                    nargs='+',
+                    default=['tree', 'linear'])
+parser.add_argument('--attention',
+                    type=str,
+                    nargs='+',
+                    choices=['on', 'off'],
+                    default=['on', 'off'])
+parser.add_argument('--hiddensizes',
+                    type=int,
+                    nargs='+',
+                    default=[150, 300])
+parser.add_argument('--regressiontypes',
+                    type=str,
+                    nargs='+',
+                    default=['linear'])
+parser.add_argument('--search',
+                    type=str,
+                    choices=['grid', 'random'],
+                    default='grid')
+parser.add_argument('--trials',
+                    type=int,
+                    default=8,
+                    help='number of configurations to draw from the ' +
+                         'grid with --search random')
+
+# training
+parser.add_argument('--epochs',
+                    type=int,
+                    default=10)
+parser.add_argument('--batch',
+                    type=int,
+                    default=128)
+parser.add_argument('--lr',
+                    type=float,
+                    default=1e-2)
+parser.add_argument('--patience',
+                    type=int,
+                    default=2)
+parser.add_argument('--devfraction',
+                    type=float,
+                    default=0.1,
+                    help='the proportion of responses held out for ' +
+                         'early stopping and model selection')
+
+# scheduling
+parser.add_argument('--cores',
+                    type=int,
+                    default=os.cpu_count(),
+                    help='the number of cores to use in total')
+parser.add_argument('--corespertrial',
+                    type=int,
+                    default=1,
+                    help='the number of torch threads of each trial')
+parser.add_argument('--seed',
+                    type=int,
+                    default=0)
+
+# set in the main process before the pool is forked, so that every
+# trial reads the same data, structures, and embeddings without
+# copying or reloading them
+data = structures = embeddings = split = args = None
+
+
+# the columns of the output, one row per trial; a failed trial has an
+# error and no results
+COLUMNS = ['rnntype', 'attention', 'hidden_size', 'regressiontype',
+           'validation_loss', 'evaluations', 'seconds', 'error']
+
+
+def configurations(args):
+    """The configurations to try, as dicts"""
+    grid = [{'rnntype': rnntype,
+             'attention': attention == 'on',
+             'hidden_size': hidden_size,
+             'regressiontype': regressiontype}
+            for rnntype, attention, hidden_size, regressiontype
+            in itertools.product(args.rnntypes, args.attention,
+                                 args.hiddensizes, args.regressiontypes)]
+
+    if args.search == 'random':
+        rng = np.random.RandomState(args.seed)
+        grid = [grid[i] for i in rng.permutation(len(grid))[:args.trials]]
+
+    return grid
+
+
+def initialize_trial_process():
+    torch.set_num_threads(args.corespertrial)
+
+    # the trainer reports progress on stdout, which would interleave
+    sys.stdout = open(os.devnull, 'w')
+
+
+def run_trial(config):
+    """Train one configuration and report its best validation loss"""
+    torch.manual_seed(args.seed)
+
+    x_raw, y_raw, rnn_class = inputs_and_targets(data, structures,
+                                                 config['rnntype'],
+                                                 config['regressiontype'])
+
+    train_idx, dev_idx = split
+
+    x_train = [x_raw[i] for i in train_idx]
+    y_train = y_raw[train_idx]
+
+    x = [x_train[i:i + args.batch]
+         for i in range(0, len(x_train), args.batch)]
+    y = [y_train[i:i + args.batch]
+         for i in range(0, len(y_train), args.batch)]
+
+    trainer = RNNRegressionTrainer(embeddings=embeddings,
+                                   rnn_classes=rnn_class, bidirectional=True,
+                                   attention=config['attention'],
+                                   epochs=args.epochs,
+                                   regression_type=config['regressiontype'],
+                                   rnn_hidden_sizes=config['hidden_size'],
+                                   num_rnn_layers=1,
+                                   regression_hidden_sizes=(
+                                       config['hidden_size'] // 2,))
+
+    start = time.perf_counter()
+    trainer.fit(X=x, Y=y, lr=args.lr, verbosity=0,
+                validation=([x_raw[i] for i in dev_idx], y_raw[dev_idx]),
+                patience=args.patience)
+
+    return dict(config,
+                validation_loss=min(trainer.validation_losses),
+                evaluations=len(trainer.validation_losses),
+                seconds=time.perf_counter() - start)
+
+
+if __name__ == '__main__':
+    # parse arguments
+    args = parser.parse_args()
+
+    data, structures, embeddings = load_data(args)
+
+    rng = np.random.RandomState(args.seed)
+    order = rng.permutation(data.shape[0])
+    num_dev = int(args.devfraction * data.shape[0])
+    split = (order[num_dev:], order[:num_dev])
+
+    configs = configurations(args)
+    processes = max(1, args.cores // args.corespertrial)
+
+    print('running', len(configs), 'trials in', processes, 'processes',
+          'with', args.corespertrial, 'cores each\n')
+
+    # forked, so that the trial processes inherit the loaded data
+    context = multiprocessing.get_context('fork')
+    results = []
+
+    # each row is appended as soon as its trial finishes, so the
+    # finished trials survive an interrupted sweep
+    pd.DataFrame(columns=COLUMNS).to_csv(args.output, sep='\t', index=False)
+
+    with ProcessPoolExecutor(processes, mp_context=context,
+                             initializer=initialize_trial_process) as pool:
+        futures = {pool.submit(run_trial, config): config
+                   for config in configs}
+
+        for future in as_completed(futures):
+            # a failing trial is recorded rather than ending the sweep
+            try:
+                result = future.result()
+            except Exception as error:
+                result = dict(futures[future], error=repr(error))
+
+            results.append(result)
+
+            pd.DataFrame([result], columns=COLUMNS).to_csv(args.output,
+                                                           sep='\t',
+                                                           mode='a',
+                                                           header=False,
+                                                           index=False)
+
+            print(len(results), '/', len(configs), 'done:', results[-1])
+
+    # validation losses are only comparable within a regression type
+    results = pd.DataFrame(results, columns=COLUMNS)
+    results = results.sort_values(['regressiontype', 'validation_loss'])
+    results.to_csv(args.output, sep='\t', index=False)
+
+    print()
+    print(results.to_string(index=False))
@@ -1,2 +1,4 @@
+from .indexedtree import *
 from .constituencytree import *
 from .dependencytree import *
+from .compacttree import *
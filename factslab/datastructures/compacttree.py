@@ -0,0 +1,311 @@
+import nltk
+import numpy as np
+from itertools import chain
+from .dependencytree import DependencyTree
+
+
+class Vocabulary(object):
+    """A bidirectional mapping between strings and integer ids
+
+    Vocabularies are shared by many CompactTrees, so that each tree
+    only stores integer ids
+
+    Parameters
+    ----------
+    strings : iterable(str)
+        the initial strings, which get ids 0, 1, ...
+    """
+
+    __slots__ = ['strings', 'ids']
+
+    def __init__(self, strings=()):
+        self.strings = []
+        self.ids = {}
+
+        for s in strings:
+            self.add(s)
+
+    def __len__(self):
+        return len(self.strings)
+
+    def __contains__(self, string):
+        return string in self.ids
+
+    def __getitem__(self, string):
+        return self.ids[string]
+
+    def add(self, string):
+        """Get the id of string, adding it if it is not yet present"""
+        try:
+            return self.ids[string]
+        except KeyError:
+            self.ids[string] = len(self.strings)
+            self.strings.append(string)
+
+            return self.ids[string]
+
+
+class CompactTree(object):
+    """A tree stored as a handful of flat numpy arrays
+
+    Nodes are numbered in preorder, so that every node comes after its
+    parent. Labels and tokens are stored as ids into Vocabulary
+    objects shared between trees. The nodes that have a token are
+    the inputs of the tree, and words() lists their tokens in node
+    order.
+
+    CompactTree implements the same interface as ConstituencyTree and
+    DependencyTree (with integer positions), so it can be passed
+    anywhere those can; children_idx takes time linear in the size of
+    the tree, since children are not stored.
+
+    In general, the initializer should not be used directly; rather,
+    one of the class methods from_tree or from_dependency_graph should
+    be used.
+
+    Parameters
+    ----------
+    parent : numpy.array(int)
+        the parent of each node (-1 for the root)
+    label_ids : numpy.array(int)
+        the id of each node's label in label_vocab (-1 if none)
+    terminal : numpy.array(bool)
+        whether each node is a leaf
+    token_ids : numpy.array(int)
+        the id of each node's token in token_vocab (-1 if none)
+    token_vocab : Vocabulary
+    label_vocab : Vocabulary
+    """
+
+    __slots__ = ['parent', 'label_ids', 'terminal', 'token_ids',
+                 'token_vocab', 'label_vocab']
+
+    def __init__(self, parent, label_ids, terminal, token_ids,
+                 token_vocab, label_vocab):
+        self.parent = parent
+        self.label_ids = label_ids
+        self.terminal = terminal
+        self.token_ids = token_ids
+        self.token_vocab = token_vocab
+        self.label_vocab = label_vocab
+
+    def __len__(self):
+        return self.parent.shape[0]
+
+    @classmethod
+    def from_tree(cls, tree, token_vocab=None, label_vocab=None):
+        """Convert a ConstituencyTree or DependencyTree
+
+        For a DependencyTree, every node has a token (its label for
+        internal nodes and the word itself for leaves); for any other
+        nltk.Tree, only leaves do. Internal nodes get a label id, and
+        leaves do not.
+
+        Parameters
+        ----------
+        tree : nltk.Tree
+        token_vocab : Vocabulary or NoneType
+            extended with any unseen tokens; a new Vocabulary is
+            created if None
+        label_vocab : Vocabulary or NoneType
+            extended with any unseen labels; a new Vocabulary is
+            created if None
+
+        Returns
+        -------
+        CompactTree
+        """
+        token_vocab = Vocabulary() if token_vocab is None else token_vocab
+        label_vocab = Vocabulary() if label_vocab is None else label_vocab
+
+        every_node_has_token = isinstance(tree, DependencyTree)
+
+        parent, label_ids, terminal, token_ids = [], [], [], []
+
+        # preorder with an explicit stack; entries are (parent, node)
+        stack = [(-1, tree)]
+
+        while stack:
+            p, node = stack.pop()
+
+            k = len(parent)
+            parent.append(p)
+
+            if isinstance(node, nltk.Tree):
+                label_ids.append(label_vocab.add(node.label()))
+                terminal.append(len(node) == 0)
+
+                if every_node_has_token:
+                    token_ids.append(token_vocab.add(node.label()))
+                else:
+                    token_ids.append(-1)
+
+                stack.extend([(k, child) for child in reversed(node)])
+            else:
+                label_ids.append(-1)
+                terminal.append(True)
+                token_ids.append(token_vocab.add(node))
+
+        return cls(np.array(parent, dtype=np.int32),
+                   np.array(label_ids, dtype=np.int32),
+                   np.array(terminal, dtype=bool),
+                   np.array(token_ids, dtype=np.int32),
+                   token_vocab, label_vocab)
+
+    @classmethod
+    def from_dependency_graph(cls, graph, token_vocab=None,
+                              label_vocab=None):
+        """Convert an nltk DependencyGraph
+
+        Nodes are ordered as in the tree given by graph.tree() (with
+        dependents sorted by address), every node has its word as
+        token, and every node has its dependency relation as label.
+
+        Parameters
+        ----------
+        graph : nltk.parse.DependencyGraph
+        token_vocab : Vocabulary or NoneType
+            extended with any unseen words; a new Vocabulary is
+            created if None
+        label_vocab : Vocabulary or NoneType
+            extended with any unseen relations; a new Vocabulary is
+            created if None
+
+        Returns
+        -------
+        CompactTree
+        """
+        token_vocab = Vocabulary() if token_vocab is None else token_vocab
+        label_vocab = Vocabulary() if label_vocab is None else label_vocab
+
+        parent, label_ids, terminal, token_ids = [], [], [], []
+
+        stack = [(-1, graph.root)]
+
+        while stack:
+            p, node = stack.pop()
+
+            k = len(parent)
+            deps = sorted(chain.from_iterable(node['deps'].values()))
+
+            parent.append(p)
+            label_ids.append(label_vocab.add(node['rel']))
+            terminal.append(not deps)
+            token_ids.append(token_vocab.add(node['word']))
+
+            stack.extend([(k, graph.get_by_address(d))
+                          for d in reversed(deps)])
+
+        return cls(np.array(parent, dtype=np.int32),
+                   np.array(label_ids, dtype=np.int32),
+                   np.array(terminal, dtype=bool),
+                   np.array(token_ids, dtype=np.int32),
+                   token_vocab, label_vocab)
+
+    @property
+    def positions(self):
+        return range(len(self))
+
+    @property
+    def input_rows(self):
+        """The index in words() of each node's token (-1 if none)
+
+        Returns
+        -------
+        numpy.array(int)
+        """
+        has_token = self.token_ids >= 0
+
+        return np.where(has_token, np.cumsum(has_token) - 1, -1)
+
+    @property
+    def num_tokens(self):
+        return int(np.count_nonzero(self.token_ids >= 0))
+
+    def root_idx(self):
+        return np.flatnonzero(self.parent < 0).tolist()
+
+    def children_idx(self, idx):
+        return np.flatnonzero(self.parent == idx).tolist()
+
+    def parents_idx(self, idx):
+        return [int(self.parent[idx])] if self.parent[idx] >= 0 else []
+
+    def label(self, idx=0):
+        """The label of node idx (the root by default)"""
+        label_id = self.label_ids[idx]
+
+        return self.label_vocab.strings[label_id] if label_id >= 0 else None
+
+    def tokens(self):
+        """The token ids of the inputs of the tree"""
+        return self.token_ids[self.token_ids >= 0]
+
+    def words(self):
+        strings = self.token_vocab.strings
+
+        return [strings[i] for i in self.tokens()]
+
+
+def pack_compact_trees(trees):
+    """Concatenate CompactTrees into a handful of flat arrays
+
+    The trees must share their vocabularies. The arrays can be written
+    with numpy.savez and read back without pickling.
+
+    Parameters
+    ----------
+    trees : list(CompactTree)
+
+    Returns
+    -------
+    dict(str, numpy.array)
+        the node arrays of all trees concatenated, the offset of each
+        tree's first node, and the strings of both vocabularies
+    """
+    if not trees:
+        msg = 'there must be at least one tree to pack'
+        raise ValueError(msg)
+
+    token_vocab, label_vocab = trees[0].token_vocab, trees[0].label_vocab
+
+    if any(t.token_vocab is not token_vocab or
+           t.label_vocab is not label_vocab for t in trees):
+        msg = 'the trees must share their vocabularies'
+        raise ValueError(msg)
+
+    offsets = np.concatenate([[0], np.cumsum([len(t) for t in trees])])
+
+    return {'parent': np.concatenate([t.parent for t in trees]),
+            'label_ids': np.concatenate([t.label_ids for t in trees]),
+            'terminal': np.concatenate([t.terminal for t in trees]),
+            'token_ids': np.concatenate([t.token_ids for t in trees]),
+            'offsets': offsets.astype(np.int64),
+            'token_strings': np.array(token_vocab.strings, dtype=str),
+            'label_strings': np.array(label_vocab.strings, dtype=str)}
+
+
+def unpack_compact_trees(arrays):
+    """Rebuild the CompactTrees packed by pack_compact_trees
+
+    Parameters
+    ----------
+    arrays : dict(str, numpy.array)
+        as returned by pack_compact_trees (or loaded with numpy.load)
+
+    Returns
+    -------
+    list(CompactTree)
+        sharing one token and one label Vocabulary
+    """
+    token_vocab = Vocabulary(arrays['token_strings'].tolist())
+    label_vocab = Vocabulary(arrays['label_strings'].tolist())
+
+    parent, label_ids = arrays['parent'], arrays['label_ids']
+    terminal, token_ids = arrays['terminal'], arrays['token_ids']
+    offsets = arrays['offsets'].tolist()
+
+    return [CompactTree(parent[start:end], label_ids[start:end],
+                        terminal[start:end], token_ids[start:end],
+                        token_vocab, label_vocab)
+            for start, end in zip(offsets[:-1], offsets[1:])]
@@ -1,48 +1,83 @@
 import nltk
+import numpy as np
+from .indexedtree import IndexedTree
 
 
-class DependencyTree(nltk.Tree):
+class DependencyTree(IndexedTree):
     """A dependency tree
 
     Extends the nltk.Tree class by adding public methods for get the
     indices of the root, children of a particular node, and parents of
-    a particular node.
+    a particular node. These lookups are constant time (see
+    IndexedTree).
     In general, the initializer should not be used directly; rather, the
     class method fromstring should be used to build a tree from a parse
     represented as a string using Penn TreeBank annotation conventions
 
+    Every node (internal or leaf) corresponds to one word in words(),
+    and the position of that word is precomputed along with the rest
+    of the index, so that the inputs for all nodes can be gathered in
+    a single indexing operation (see node_inputs)
     """
+
     def __init__(self, node, children=None):
         super().__init__(node, children)
 
-        # precompute positions
-        self.positions = self.treepositions()
+        self._word_indices = None
 
-    def root_idx(self):
-        return [()]
+    @property
+    def word_indices(self):
+        """The index in words() of each node in positions
 
-    def children_idx(self, idx):
-        if idx:
-            return [i for i in self.positions
-                if (len(idx) + 1) == len(i) and i[0] == idx[0]]
-        else:
-            return [i for i in self.positions
-                if (len(idx) + 1) == len(i)]
+        Returns
+        -------
+        numpy.array(int)
+        """
+        self._get_index()
 
-    def parents_idx(self, idx):
-        if idx:
-            return [idx[:-1]]
-        else:
-            return []
+        return self._word_indices
 
     def words(self):
-        return [i.label() for i in self.subtrees()] + self.leaves()
+        nodes = self._get_index().nodes
+
+        return [n.label() for n in nodes if isinstance(n, nltk.Tree)] +\
+            [n for n in nodes if not isinstance(n, nltk.Tree)]
 
     def word_index(self, idx):
         '''input: tree index ex: (), (1,)
            returns: word index in sequence
         '''
-        if isinstance(self[idx], str):
-            return self.words().index(self[idx])
-        else:
-            return self.words().index(self[idx].label())
+        return int(self.word_indices[self.ordinal(idx)])
+
+    def node_inputs(self, inputs):
+        """Gather the input for every node in positions order
+
+        Parameters
+        ----------
+        inputs : numpy.array or torch.Tensor
+            the inputs corresponding to words(), indexed along the
+            first dimension
+
+        Returns
+        -------
+        numpy.array or torch.Tensor
+        """
+        return inputs[self.word_indices]
+
+    def _build_index(self):
+        index = super()._build_index()
+
+        # words() lists the internal nodes in preorder and then the
+        # leaves in preorder
+        internal = np.array([isinstance(n, nltk.Tree) for n in index.nodes],
+                            dtype=bool)
+        num_internal = int(internal.sum())
+
+        word_indices = np.empty(internal.shape[0], dtype=np.int64)
+        word_indices[internal] = np.arange(num_internal)
+        word_indices[~internal] = num_internal +\
+            np.arange(internal.shape[0] - num_internal)
+
+        self._word_indices = word_indices
+
+        return index
@@ -0,0 +1,128 @@
+import nltk
+from collections import namedtuple
+from functools import wraps
+
+
+TreeIndex = namedtuple('TreeIndex', ['positions', 'ordinals', 'nodes',
+                                     'children', 'parents', 'depths',
+                                     'terminals'])
+
+
+def _invalidates_index(method):
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        self._index = None
+        return method(self, *args, **kwargs)
+
+    return wrapper
+
+
+class IndexedTree(nltk.Tree):
+    """An nltk.Tree with constant time structural lookups
+
+    The positions of the tree, along with the children, parent, depth,
+    and ordinal of every position, are computed in a single pass the
+    first time any of them is needed and then kept, so that
+    children_idx, parents_idx, depth, and ordinal are constant time.
+    The pass uses an explicit stack, so it works for trees of any
+    depth.
+
+    The index is discarded whenever the tree is modified through its
+    own methods (including collapse_unary and chomsky_normal_form). If
+    a subtree is modified directly after the index has been built,
+    reindex() must be called on the root.
+    """
+
+    def __init__(self, node, children=None):
+        super().__init__(node, children)
+
+        # built lazily, since nltk constructs every subtree with this
+        # initializer and most subtrees are never indexed themselves
+        self._index = None
+
+    @property
+    def positions(self):
+        return self._get_index().positions
+
+    @property
+    def terminal_indices(self):
+        return self._get_index().terminals
+
+    def root_idx(self):
+        return [()]
+
+    def children_idx(self, idx):
+        index = self._get_index()
+
+        return list(index.children[index.ordinals[idx]])
+
+    def parents_idx(self, idx):
+        index = self._get_index()
+        parent = index.parents[index.ordinals[idx]]
+
+        return [] if parent is None else [parent]
+
+    def depth(self, idx):
+        """The number of edges between idx and the root"""
+        index = self._get_index()
+
+        return index.depths[index.ordinals[idx]]
+
+    def ordinal(self, idx):
+        """The position of idx in self.positions"""
+        return self._get_index().ordinals[idx]
+
+    def reindex(self):
+        self._index = None
+        self._get_index()
+
+    def _get_index(self):
+        if self._index is None:
+            self._index = self._build_index()
+
+        return self._index
+
+    def _build_index(self):
+        positions, nodes, children, parents, depths = [], [], [], [], []
+        terminals = []
+        ordinals = {}
+
+        # visit in preorder, which is the order of self.treepositions()
+        stack = [((), self)]
+
+        while stack:
+            idx, node = stack.pop()
+
+            ordinals[idx] = len(positions)
+            positions.append(idx)
+            nodes.append(node)
+            children.append([])
+            depths.append(len(idx))
+
+            if idx:
+                parent = idx[:-1]
+                parents.append(parent)
+                children[ordinals[parent]].append(idx)
+            else:
+                parents.append(None)
+
+            if isinstance(node, nltk.Tree):
+                stack.extend([(idx + (i,), node[i])
+                              for i in reversed(range(len(node)))])
+            else:
+                terminals.append(idx)
+
+        return TreeIndex(positions, ordinals, nodes, children, parents,
+                         depths, terminals)
+
+    __setitem__ = _invalidates_index(nltk.Tree.__setitem__)
+    __delitem__ = _invalidates_index(nltk.Tree.__delitem__)
+    append = _invalidates_index(nltk.Tree.append)
+    extend = _invalidates_index(nltk.Tree.extend)
+    insert = _invalidates_index(nltk.Tree.insert)
+    pop = _invalidates_index(nltk.Tree.pop)
+    remove = _invalidates_index(nltk.Tree.remove)
+    collapse_unary = _invalidates_index(nltk.Tree.collapse_unary)
+    chomsky_normal_form = _invalidates_index(nltk.Tree.chomsky_normal_form)
+    un_chomsky_normal_form =\
+        _invalidates_index(nltk.Tree.un_chomsky_normal_form)
@@ -0,0 +1,171 @@
+import os
+import re
+import torch
+from threading import Thread
+
+
+def _to_cpu(obj):
+    """A copy of obj with every tensor cloned to the cpu"""
+    if torch.is_tensor(obj):
+        return obj.detach().to('cpu', copy=True)
+    elif isinstance(obj, dict):
+        return type(obj)((k, _to_cpu(v)) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple)):
+        return type(obj)(_to_cpu(v) for v in obj)
+    else:
+        return obj
+
+
+class Checkpointer(object):
+    """Periodic checkpoints written in a background thread
+
+    Saving takes a snapshot of the state on the calling thread (every
+    tensor is copied to the cpu), so that training can go on changing
+    the parameters while the snapshot is written to disk by a
+    background thread. At most one write is in flight: saving again
+    first waits for the previous write to finish.
+
+    Each checkpoint is written to a temporary file which is then
+    renamed over its final name, and the directory is synced after
+    the rename, so a checkpoint on disk is always complete and
+    survives a crash, even if the process is killed while writing.
+    Only the last keep checkpoints are kept.
+
+    Parameters
+    ----------
+    directory : str
+        where to write the checkpoints; created if needed
+    keep : int
+        the number of most recent checkpoints to keep
+    """
+
+    pattern = re.compile(r'^checkpoint-(\d+)\.pt$')
+
+    def __init__(self, directory, keep=3):
+        if keep < 1:
+            msg = 'keep must be positive'
+            raise ValueError(msg)
+
+        self.directory = directory
+        self.keep = keep
+
+        self._thread = None
+        self._error = None
+
+        os.makedirs(directory, exist_ok=True)
+
+    def save(self, state, step):
+        """Write state as the checkpoint of step in the background
+
+        Parameters
+        ----------
+        state : dict
+            anything torch.save can write; tensors are snapshotted
+            before this returns
+        step : int
+            the number of training steps taken so far
+        """
+        snapshot = _to_cpu(state)
+
+        self.wait()
+
+        self._thread = Thread(target=self._write, args=(snapshot, step),
+                              daemon=True)
+        self._thread.start()
+
+    def wait(self):
+        """Block until the last write is done
+
+        An exception raised while writing is raised again here.
+        """
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def checkpoints(self):
+        """The paths of the checkpoints on disk, oldest first"""
+        return list_checkpoints(self.directory)
+
+    def _write(self, snapshot, step):
+        path = os.path.join(self.directory,
+                            'checkpoint-{:09d}.pt'.format(step))
+        tmppath = path + '.tmp'
+
+        try:
+            with open(tmppath, 'wb') as f:
+                torch.save(snapshot, f)
+                f.flush()
+                os.fsync(f.fileno())
+
+            os.replace(tmppath, path)
+            self._fsync_directory()
+
+            for old in self.checkpoints()[:-self.keep]:
+                os.remove(old)
+        except Exception as error:
+            self._error = error
+
+    def _fsync_directory(self):
+        # the rename is only durable once the directory entry is on
+        # disk; directories cannot be opened this way on Windows
+        if not hasattr(os, 'O_DIRECTORY'):
+            return
+
+        fd = os.open(self.directory, os.O_RDONLY | os.O_DIRECTORY)
+
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+def list_checkpoints(directory):
+    """The paths of the checkpoints in directory, oldest first
+
+    Parameters
+    ----------
+    directory : str
+
+    Returns
+    -------
+    list(str)
+    """
+    if not os.path.isdir(directory):
+        return []
+
+    steps = [(int(match.group(1)), name)
+             for match, name in ((Checkpointer.pattern.match(name), name)
+                                 for name in os.listdir(directory))
+             if match]
+
+    return [os.path.join(directory, name) for _, name in sorted(steps)]
+
+
+def load_checkpoint(path):
+    """Load a checkpoint
+
+    Parameters
+    ----------
+    path : str
+        a checkpoint file, or a directory of checkpoints, in which case
+        the most recent one is loaded
+
+    Returns
+    -------
+    dict
+    """
+    if os.path.isdir(path):
+        paths = list_checkpoints(path)
+
+        if not paths:
+            msg = 'no checkpoints in ' + path
+            raise ValueError(msg)
+
+        path = paths[-1]
+
+    # checkpoints hold numpy arrays and RNG states alongside tensors
+    return torch.load(path, map_location='cpu', weights_only=False)
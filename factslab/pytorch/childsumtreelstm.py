@@ -3,9 +3,11 @@ import torch
 import torch.nn.functional as F
 import pdb
 from abc import ABCMeta, abstractmethod
-from factslab.datastructures import ConstituencyTree
-from torch.nn.modules.dropout import Dropout
+from factslab.datastructures import CompactTree, ConstituencyTree
 from torch.nn.modules.rnn import RNNBase
+from .treeplan import TreePlan, TreePlanCache
+from .treeplan import compile_tree_plan, compile_parent_plan
+from .treeplan import dependency_order
 
 if sys.version_info.major == 3:
     from functools import lru_cache
@@ -20,18 +22,77 @@ class ChildSumTreeLSTM(RNNBase):
     its subclasses:
       - ChildSumDependencyTreeLSTM
       - ChildSumConstituencyTreeLSTM
+
+    In addition to the parameters of torch.nn.LSTM, the subclasses
+    accept an `execution` keyword argument that determines how the
+    tree is traversed:
+      - 'level' (default): group nodes by height (upward pass) or
+        depth (downward pass) and compute each group with one batched
+        matmul and a scatter-add over children; when a list of trees
+        is passed to forward(), the trees are merged into a single
+        forest, so that each group spans all of the trees
+      - 'node': visit one node at a time, running the gate
+        computations separately for each node (and each tree
+        separately); this computes the same function as 'level' but
+        launches far more kernels
+
+    Trees are compiled into flat execution plans (see TreePlan) the
+    first time they are seen, and the plans are kept in a bounded LRU
+    cache keyed by tree identity, whose size can be set with the
+    `plan_cache_size` keyword argument (default: 1024; None for
+    unbounded). Cache statistics are available from plan_cache_info().
+
+    The forest plans of lists of trees are only cached on request,
+    since each cached forest keeps all of its trees alive: with
+    cache_forests(maxsize) (or the `forest_cache_size` keyword
+    argument, default: 0), up to maxsize forests are kept, keyed by
+    the identities of their trees in order, so that a minibatch passed
+    again in training mode reuses its plan and levels. This only pays
+    off when the same minibatches recur, e.g. every epoch over a fixed
+    list of minibatches; in eval mode, forests are never cached.
+    Statistics are available from forest_cache_info().
     """
 
     __metaclass__ = ABCMeta
 
+    execution_modes = ['level', 'node']
+
     def __init__(self, *args, **kwargs):
+        execution = kwargs.pop('execution', 'level')
+        plan_cache_size = kwargs.pop('plan_cache_size', 1024)
+        forest_cache_size = kwargs.pop('forest_cache_size', 0)
+
         super(ChildSumTreeLSTM, self).__init__('LSTM', *args, **kwargs)
 
+        if execution not in self.__class__.execution_modes:
+            msg = 'execution must be one of {}'
+            raise ValueError(msg.format(self.__class__.execution_modes))
+
+        self.execution = execution
+
+        self._plan_cache = TreePlanCache(plan_cache_size)
+        self._forest_cache = TreePlanCache(forest_cache_size)
+
         # lru_cache is normally used as a decorator, but that usage
         # leads to a global cache, where we need an instance specific
         # cache
         self._get_parameters = lru_cache()(self._get_parameters)
 
+    def __getstate__(self):
+        # the instance cache cannot be pickled, and cached plans are
+        # keyed by the ids of trees in this process
+        state = super(ChildSumTreeLSTM, self).__getstate__().copy()
+        del state['_get_parameters']
+        state['_plan_cache'] = TreePlanCache(self._plan_cache.maxsize)
+        state['_forest_cache'] = TreePlanCache(self._forest_cache.maxsize)
+
+        return state
+
+    def __setstate__(self, state):
+        super(ChildSumTreeLSTM, self).__setstate__(state)
+
+        self._get_parameters = lru_cache()(self._get_parameters)
+
     @staticmethod
     def nonlinearity(x):
         return F.tanh(x)
@@ -43,60 +104,75 @@ class ChildSumTreeLSTM(RNNBase):
         inputs : torch.Tensor
             a 2D (steps x embedding dimension) or a 3D tensor (steps x
             batch dimension x embedding dimension); the batch
-            dimension must always have size == 1, since this module
-            does not support minibatching
-        tree : nltk.DependencyGraph
-            must implement the following instance methods
+            dimension must always have size == 1, since minibatches
+            are built by passing a list of trees instead. When a list
+            of trees is passed, inputs must contain the inputs for
+            each tree concatenated along the steps dimension
+        tree : nltk.DependencyGraph or list(nltk.DependencyGraph)
+            a CompactTree, or a tree that must implement the following
+            instance methods
             - root_idx: all root indices in the tree
             - children_idx: indices of children of a particular index
             - parents_idx: indices of parents of a particular index
-            - is_terminal_idx: whether the node is terminal
+            - words: the sequence the inputs correspond to
+            and the attribute positions, listing every node index.
+            Dependency trees must also implement word_index (the
+            index in words of a node's input) or provide all of those
+            indices, in the order of positions, as word_indices;
+            constituency trees must provide terminal_indices (the
+            leaf indices, in the order of words)
 
         Returns
         -------
-        hidden_all : torch.Tensor
+        hidden_all : torch.Tensor or list(torch.Tensor)
+            the hidden states of all nodes in the tree; when a list of
+            trees is passed, a list of (nodes x hidden) tensors, one
+            for each tree
         hidden_final : torch.Tensor
             the hidden state of the trees root node; if there are two
             or more such nodes, the average of their hidden states is
-            returned
+            returned; when a list of trees is passed, a (trees x
+            hidden) tensor
         """
 
+        # trees are themselves lists (nltk.Tree subclasses list), so
+        # a forest is recognized by lacking the tree interface
+        is_forest = not hasattr(tree, 'root_idx')
+        trees = tree if is_forest else [tree]
+
         self._validate_inputs(inputs)
 
-        ridx = tree.root_idx()
+        if self._has_batch_dimension:
+            inputs = inputs[:, 0]
 
-        self.hidden_state = {}
-        self.cell_state = {}
+        if is_forest and self.training:
+            plan = self._forest_cache.get_forest(trees,
+                                                 self._concatenate_plans)
+        elif is_forest:
+            plan = self._concatenate_plans(trees)
+        else:
+            plan = self._get_plan(tree)
 
-        for layer in range(self.num_layers):
-            self.hidden_state[layer] = {'up': {}, 'down': {}}
-            self.cell_state[layer] = {'up': {}, 'down': {}}
+        self._validate_packing(inputs, plan)
 
-            for i in ridx:
-                self._upward_downward(layer, 'up', inputs, tree, i)
+        hidden_all = self._run_layers(inputs, plan)
 
-        # sort the indices; only really matters for constituency trees,
-        # since dependency trees can be linearized in the same order
-        # as the original inputs, while constituency trees will have
-        # more hidden states than there are inputs
-        indices = tree.positions
+        roots = torch.from_numpy(plan.roots).to(hidden_all.device)
+        root_trees = torch.from_numpy(plan.root_trees).to(hidden_all.device)
 
-        hidden_up = self.hidden_state[self.num_layers - 1]['up']
+        root_counts = torch.bincount(root_trees, minlength=plan.num_trees)
+        hidden_final = hidden_all.new_zeros(plan.num_trees,
+                                            hidden_all.size(1))
+        hidden_final = hidden_final.index_add(0, root_trees,
+                                              hidden_all[roots])
+        hidden_final = hidden_final / root_counts[:, None].to(hidden_all.dtype)
 
-        if self.bidirectional:
-            hidden_down = self.hidden_state[self.num_layers - 1]['down']
-            hidden_all = [torch.cat([hidden_up[i], hidden_down[i]])
-                          for i in indices]
+        if is_forest:
+            return list(torch.split(hidden_all, plan.sizes)), hidden_final
         else:
-            hidden_all = [hidden_up[i] for i in indices]
-
-        hidden_final = [hidden_all[k]
-                        for k, i in enumerate(indices)
-                        if i in ridx]
-
-        hidden_all = torch.stack(hidden_all)
-        hidden_final = torch.mean(torch.stack(hidden_final), 0, keepdim=False)
+            return self._postprocess_hidden(hidden_all, hidden_final[0])
 
+    def _postprocess_hidden(self, hidden_all, hidden_final):
         if self._has_batch_dimension:
             if self.batch_first:
                 return hidden_all[None, :, :], hidden_final[None, :]
@@ -105,32 +181,104 @@ class ChildSumTreeLSTM(RNNBase):
         else:
             return hidden_all, hidden_final
 
-    def _upward_downward(self, layer, direction, inputs, tree, idx):
+    def plan_cache_info(self):
+        """Report hits, misses, maxsize, and currsize of the plan cache"""
+        return self._plan_cache.cache_info()
+
+    def forest_cache_info(self):
+        """Report hits, misses, maxsize, and currsize of the forest cache"""
+        return self._forest_cache.cache_info()
+
+    def plan_cache_clear(self):
+        self._plan_cache.cache_clear()
+        self._forest_cache.cache_clear()
+
+    def cache_forests(self, maxsize):
+        """Keep the plans of up to maxsize forests
+
+        Any forests already cached are dropped, so cache_forests(0)
+        stops caching forests and frees their trees.
+
+        Parameters
+        ----------
+        maxsize : int or NoneType
+            the maximum number of forests to keep; None means unbounded
+        """
+        self._forest_cache = TreePlanCache(maxsize)
+
+    def _get_plan(self, tree):
+        return self._plan_cache.get(tree, self._compile_plan)
+
+    def _concatenate_plans(self, trees):
+        return TreePlan.concatenate([self._get_plan(t) for t in trees])
+
+    def _compile_plan(self, tree):
+        # compact trees carry their own node-to-input mapping, which
+        # is the same for either subclass
+        if isinstance(tree, CompactTree):
+            return compile_parent_plan(tree.parent, tree.input_rows,
+                                       tree.num_tokens)
+
+        return compile_tree_plan(tree, self._input_rows(tree),
+                                 self._num_inputs(tree))
+
+    def _run_layers(self, inputs, plan):
+        # append a row of zeros for nodes that have no input
+        padded = torch.cat([inputs, inputs.new_zeros(1, inputs.size(1))])
+        rows = torch.from_numpy(plan.input_rows).to(inputs.device)
+        x = padded[rows.masked_fill(rows < 0, inputs.size(0))]
+
+        if self.execution == 'level':
+            run = self._run_levels
+        else:
+            run = self._run_nodes
+
+        for layer in range(self.num_layers):
+            h_up = run(layer, 'up', x, plan)
+
+            if self.bidirectional:
+                h_down = run(layer, 'down', x, plan)
+                x = torch.cat([h_up, h_down], 1)
+            else:
+                x = h_up
+
+        return x
+
+    def _run_nodes(self, layer, direction, x, plan):
+        """Run one direction of one layer one node at a time
+
+        Nodes are visited by an explicit-stack scheduler that only
+        yields a node once all of its children (or its parent) have
+        been computed, so no recursion is needed regardless of depth
+        """
+        if direction == 'up':
+            previous = plan.children()
+        else:
+            previous = plan.parents()
+
+        self.hidden_state = [None] * plan.num_nodes
+        self.cell_state = [None] * plan.num_nodes
+
+        for k in dependency_order(previous):
+            self._upward_downward(layer, direction, x, previous, k)
+
+        return torch.stack(self.hidden_state)
+
+    def _upward_downward(self, layer, direction, x, previous, k):
         # check to see whether this node has been computed on this
         # layer in this direction, if so short circuit the rest of
         # this function and return that result
-        if idx in self.hidden_state[layer][direction]:
-            h_t = self.hidden_state[layer][direction][idx]
-            c_t = self.cell_state[layer][direction][idx]
+        if self.hidden_state[k] is not None:
+            return self.hidden_state[k], self.cell_state[k]
 
-            return h_t, c_t
+        x_t = x[k]
 
-        x_t = self._construct_x_t(layer, inputs, idx, tree)
-
-        oidx, (h_prev, c_prev) = self._construct_previous(layer, direction,
-                                                          inputs, tree, idx)
+        h_prev, c_prev = self._construct_previous(layer, direction,
+                                                  x, previous, k)
 
         if self.bias:
             Wih, Whh, bih, bhh = self._get_parameters(layer, direction)
 
-            # print(Wih.size())
-            # print(Whh.size())
-            # print(bih.size())
-            # print(bhh.size())
-
-            # print(x_t.size())
-            # print(h_prev.size())
-
             fcio_t_raw = torch.matmul(Whh, h_prev) +\
                 torch.matmul(Wih, x_t[:, None]) +\
                 bhh[:, None] + bih[:, None]
@@ -162,18 +310,97 @@ class ChildSumTreeLSTM(RNNBase):
         h_t = torch.mul(o_t, self.__class__.nonlinearity(c_t))
 
         if self.dropout:
-            dropout = Dropout(p=self.dropout)
-            h_t = dropout(h_t)
-            c_t = dropout(c_t)
+            h_t = F.dropout(h_t, p=self.dropout, training=self.training)
+            c_t = F.dropout(c_t, p=self.dropout, training=self.training)
 
-        self.hidden_state[layer][direction][idx] = h_t
-        self.cell_state[layer][direction][idx] = c_t
-
-        if direction == 'up' and self.bidirectional:
-            self._upward_downward(layer, 'down', inputs, tree, idx)
+        self.hidden_state[k] = h_t
+        self.cell_state[k] = c_t
 
         return h_t, c_t
 
+    def _construct_previous(self, layer, direction, x, previous, k):
+        # the scheduler guarantees that the previous nodes have
+        # already been computed
+        if previous[k]:
+            h_prev = torch.stack([self.hidden_state[i]
+                                  for i in previous[k]], 1)
+            c_prev = torch.stack([self.cell_state[i]
+                                  for i in previous[k]], 1)
+
+        else:
+            h_prev = x.new_zeros(self.hidden_size, 1)
+            c_prev = x.new_zeros(self.hidden_size, 1)
+
+        return h_prev, c_prev
+
+    def _run_levels(self, layer, direction, x, plan):
+        """Run one direction of one layer level-synchronously
+
+        Nodes are grouped by height for the upward pass and by depth
+        for the downward pass, so that every node in a group can be
+        computed with a single matmul over its children (or parent)
+        """
+        if self.bias:
+            Wih, Whh, bih, bhh = self._get_parameters(layer, direction)
+            x_proj = torch.matmul(x, Wih.t()) + bih + bhh
+        else:
+            Wih, Whh = self._get_parameters(layer, direction)
+            x_proj = torch.matmul(x, Wih.t())
+
+        h = x.new_zeros(x.size(0), self.hidden_size)
+        c = x.new_zeros(x.size(0), self.hidden_size)
+
+        for level in plan.levels(direction):
+            nodes, src, dst, counts = [t.to(x.device) for t in level]
+
+            f_x, cio_x = torch.split(x_proj[nodes],
+                                     [self.hidden_size, 3 * self.hidden_size],
+                                     dim=1)
+
+            # the node-at-a-time implementation adds the input
+            # projection once per child column before summing over
+            # children, so the input contribution is scaled by the
+            # number of children
+            cio_t_raw = cio_x * counts[:, None]
+            gated_children = x.new_zeros(nodes.size(0), self.hidden_size)
+
+            if src.numel():
+                f_h, cio_h = torch.split(torch.matmul(h[src], Whh.t()),
+                                         [self.hidden_size,
+                                          3 * self.hidden_size],
+                                         dim=1)
+
+                f_t = F.sigmoid(f_h + f_x[dst])
+
+                gated_children = gated_children.index_add(0, dst,
+                                                          f_t * c[src])
+                cio_t_raw = cio_t_raw.index_add(0, dst, cio_h)
+
+            c_hat_t_raw, i_t_raw, o_t_raw = torch.split(cio_t_raw,
+                                                        self.hidden_size,
+                                                        dim=1)
+
+            c_hat_t = self.__class__.nonlinearity(c_hat_t_raw)
+            i_t = F.sigmoid(i_t_raw)
+            o_t = F.sigmoid(o_t_raw)
+
+            c_t = gated_children + torch.mul(i_t, c_hat_t)
+            h_t = torch.mul(o_t, self.__class__.nonlinearity(c_t))
+
+            if self.dropout:
+                h_t = F.dropout(h_t, p=self.dropout, training=self.training)
+                c_t = F.dropout(c_t, p=self.dropout, training=self.training)
+
+            h.index_copy_(0, nodes, h_t)
+            c.index_copy_(0, nodes, c_t)
+
+        return h
+
+    def _validate_packing(self, inputs, plan):
+        if inputs.size(0) != plan.num_inputs:
+            msg = 'inputs has {} steps, but the trees have {} inputs'
+            raise ValueError(msg.format(inputs.size(0), plan.num_inputs))
+
     def _validate_inputs(self, inputs):
         if len(inputs.size()) == 3:
             self._has_batch_dimension = True
@@ -212,39 +439,12 @@ class ChildSumTreeLSTM(RNNBase):
             return Wih, Whh
 
     @abstractmethod
-    def _construct_x_t(self, layer, inputs, idx):
+    def _input_rows(self, tree):
+        """The input row of each node in tree.positions (-1 if none)"""
         raise NotImplementedError
 
-    def _construct_previous(self, layer, direction, inputs, tree, idx):
-        if direction == 'up':
-            oidx = tree.children_idx(idx)
-        else:
-            oidx = tree.parents_idx(idx)
-
-        if oidx:
-            h_prev, c_prev = [], []
-
-            for i in oidx:
-                h_prev_i, c_prev_i = self._upward_downward(layer,
-                                                           direction,
-                                                           inputs,
-                                                           tree, i)
-
-                h_prev.append(h_prev_i)
-                c_prev.append(c_prev_i)
-
-            h_prev = torch.stack(h_prev, 1)
-            c_prev = torch.stack(c_prev, 1)
-
-        elif inputs.is_cuda:
-            h_prev = torch.zeros(self.hidden_size, 1).cuda()
-            c_prev = torch.zeros(self.hidden_size, 1).cuda()
-
-        else:
-            h_prev = torch.zeros(self.hidden_size, 1)
-            c_prev = torch.zeros(self.hidden_size, 1)
-
-        return oidx, (h_prev, c_prev)
+    def _num_inputs(self, tree):
+        return len(tree.words())
 
 
 class ChildSumDependencyTreeLSTM(ChildSumTreeLSTM):
@@ -265,20 +465,12 @@ class ChildSumDependencyTreeLSTM(ChildSumTreeLSTM):
 
     """
 
-    def _construct_x_t(self, layer, inputs, idx, tree):
-        if layer > 0 and self.bidirectional:
-            x_t = torch.cat([self.hidden_state[layer - 1]['up'][idx],
-                             self.hidden_state[layer - 1]['down'][idx]])
-        elif layer > 0:
-            x_t = self.hidden_state[layer - 1]['up'][idx]
-        elif self._has_batch_dimension:
-            word_idx = tree.word_index(idx)
-            x_t = inputs[word_idx, 0]
-        else:
-            word_idx = tree.word_index(idx)
-            x_t = inputs[word_idx]
+    def _input_rows(self, tree):
+        # DependencyTree computes all of the indices at once
+        if hasattr(tree, 'word_indices'):
+            return tree.word_indices
 
-        return x_t
+        return [tree.word_index(idx) for idx in tree.positions]
 
 
 class ChildSumConstituencyTreeLSTM(ChildSumTreeLSTM):
@@ -295,30 +487,7 @@ class ChildSumConstituencyTreeLSTM(ChildSumTreeLSTM):
     states will be larger than its inputs.
     """
 
-    def _construct_x_t(self, layer, inputs, idx, tree):
-        if layer > 0 and self.bidirectional:
-            x_t = torch.cat([self.hidden_state[layer - 1]['up'][idx],
-                             self.hidden_state[layer - 1]['down'][idx]])
-        elif layer > 0:
-            x_t = self.hidden_state[layer - 1]['up'][idx]
-        else:
-            if idx in tree.terminal_indices:
-                string_idx = tree.terminal_indices.index(idx)
-
-                if self._has_batch_dimension:
-                    x_t = inputs[string_idx, 0]
-                else:
-                    x_t = inputs[string_idx]
-            else:
-                if self._has_batch_dimension:
-                    x_t_raw = torch.zeros(self.input_size, 1)
-                else:
-                    x_t_raw = torch.zeros(self.input_size)
-
-                if inputs.is_cuda:
-                    x_t = x_t_raw.cuda()
-
-                else:
-                    x_t = x_t_raw
+    def _input_rows(self, tree):
+        string_idx = {idx: i for i, idx in enumerate(tree.terminal_indices)}
 
-        return x_t
+        return [string_idx.get(idx, -1) for idx in tree.positions]
@@ -0,0 +1,82 @@
+import numpy as np
+import torch
+
+
+def flatten_sequences(sequences, dtype=np.int64):
+    """Concatenate sequences into one flat array with offsets
+
+    Parameters
+    ----------
+    sequences : iterable(iterable(int))
+    dtype : numpy.dtype
+
+    Returns
+    -------
+    flat : numpy.array
+        the elements of all sequences, in order
+    offsets : numpy.array(int)
+        sequence i is flat[offsets[i]:offsets[i+1]]
+    """
+    sequences = [s if isinstance(s, np.ndarray) else np.asarray(s, dtype)
+                 for s in sequences]
+
+    lengths = np.array([s.shape[0] for s in sequences], dtype=np.int64)
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+
+    if sequences:
+        flat = np.concatenate(sequences).astype(dtype, copy=False)
+    else:
+        flat = np.zeros(0, dtype=dtype)
+
+    return flat, offsets
+
+
+def pad_flat(flat, offsets, device=None, padding_value=0):
+    """Build a padded batch from a flat array of indices and offsets
+
+    Rows are sorted by decreasing length (ties keep their order), as
+    pack_padded_sequence expects. The padded matrix is built with a
+    single scatter in numpy and moved to device with one copy, which
+    does not block when device is a GPU.
+
+    Parameters
+    ----------
+    flat : numpy.array(int)
+        the concatenated sequences
+    offsets : numpy.array(int)
+        sequence i is flat[offsets[i]:offsets[i+1]]
+    device : torch.device or NoneType
+        where to put the padded matrix (default: cpu)
+    padding_value : int
+
+    Returns
+    -------
+    padded : torch.LongTensor
+        a batch-by-max length matrix on device
+    lengths : torch.LongTensor
+        the sorted lengths, on the cpu
+    order : torch.LongTensor
+        the sequence in each row of padded, on the cpu
+    """
+    offsets = np.asarray(offsets, dtype=np.int64)
+    lengths = np.diff(offsets)
+
+    order = np.argsort(-lengths, kind='stable')
+    sorted_lengths = lengths[order]
+    max_length = int(sorted_lengths[0]) if sorted_lengths.shape[0] else 0
+
+    steps = np.arange(max_length)
+    mask = steps[None, :] < sorted_lengths[:, None]
+
+    padded = np.full((lengths.shape[0], max_length), padding_value,
+                     dtype=np.int64)
+    padded[mask] = flat[(offsets[order][:, None] + steps[None, :])[mask]]
+
+    padded = torch.from_numpy(padded)
+
+    if device is not None and torch.device(device).type == 'cuda':
+        padded = padded.pin_memory().to(device, non_blocking=True)
+    elif device is not None:
+        padded = padded.to(device)
+
+    return padded, torch.from_numpy(sorted_lengths), torch.from_numpy(order)
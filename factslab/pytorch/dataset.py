@@ -0,0 +1,207 @@
+import numpy as np
+from queue import Queue, Full
+from threading import Event, Thread
+
+
+class IndexedBatch(object):
+    """A minibatch drawn from an IndexedDataset
+
+    Parameters
+    ----------
+    structures : list(object)
+        the structures in the batch
+    ids : numpy.array(int)
+        the vocab ids of the words of all structures, concatenated
+    offsets : numpy.array(int)
+        the ids of structure i are ids[offsets[i]:offsets[i+1]]
+    targets : numpy.array or NoneType
+        one target per structure
+    inputs : tuple or NoneType
+        the model inputs built from ids, if they were built ahead of
+        time (see RNNRegression._collate)
+    """
+
+    __slots__ = ['structures', 'ids', 'offsets', 'targets', 'inputs']
+
+    def __init__(self, structures, ids, offsets, targets=None,
+                 inputs=None):
+        self.structures = structures
+        self.ids = ids
+        self.offsets = offsets
+        self.targets = targets
+        self.inputs = inputs
+
+    def __len__(self):
+        return len(self.structures)
+
+
+class IndexedDataset(object):
+    """Structures whose words are mapped to vocab ids once
+
+    The words of every structure are looked up in vocab_hash when the
+    dataset is built, and the ids are stored in one flat array with
+    offsets, so that minibatches are built by slicing arrays rather
+    than by looking up strings.
+
+    Structures that already store token ids (e.g. CompactTrees) are
+    not looked up word by word: each distinct token vocabulary is
+    mapped to vocab_hash once, and their ids are translated with it.
+
+    Parameters
+    ----------
+    structures : iterable(object)
+        sequences of words, objects implementing a words() method
+        (e.g. trees), or objects implementing a tokens() method and a
+        token_vocab attribute (e.g. CompactTrees)
+    vocab_hash : dict(str, int)
+        the id of each word
+    targets : iterable or NoneType
+        one target per structure
+    """
+
+    def __init__(self, structures, vocab_hash, targets=None):
+        self.structures = list(structures)
+
+        # the translation of each token vocabulary, by id of the
+        # vocabulary
+        tables = {}
+
+        ids = [self._ids(s, vocab_hash, tables) for s in self.structures]
+
+        self.lengths = np.array([i.shape[0] for i in ids], dtype=np.int64)
+        self.offsets = np.concatenate([[0], np.cumsum(self.lengths)])
+        self.ids = np.concatenate(ids) if ids else\
+            np.zeros(0, dtype=np.int64)
+
+        if targets is None:
+            self.targets = None
+        else:
+            self.targets = np.asarray(list(targets))
+
+            if self.targets.shape[0] != len(self.structures):
+                msg = 'there must be exactly one target per structure'
+                raise ValueError(msg)
+
+    def __len__(self):
+        return len(self.structures)
+
+    @staticmethod
+    def _ids(structure, vocab_hash, tables):
+        """The vocab ids of the words of one structure"""
+        if hasattr(structure, 'tokens') and\
+           hasattr(structure, 'token_vocab'):
+            vocab = structure.token_vocab
+
+            if id(vocab) not in tables:
+                tables[id(vocab)] = np.array([vocab_hash.get(w, -1)
+                                              for w in vocab.strings],
+                                             dtype=np.int64)
+
+            ids = tables[id(vocab)][structure.tokens()]
+
+            if (ids < 0).any():
+                # raise the same error as a lookup of the words
+                for w in structure.words():
+                    vocab_hash[w]
+
+            return ids
+
+        words = structure.words() if hasattr(structure, 'words')\
+            else structure
+
+        return np.fromiter((vocab_hash[w] for w in words),
+                           dtype=np.int64, count=len(words))
+
+    def batch(self, indices):
+        """Gather the structures at indices into an IndexedBatch
+
+        Parameters
+        ----------
+        indices : iterable(int)
+
+        Returns
+        -------
+        IndexedBatch
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+
+        lengths = self.lengths[indices]
+        offsets = np.concatenate([[0], np.cumsum(lengths)])
+
+        # the position in self.ids of every id in the batch
+        starts = np.repeat(self.offsets[indices] - offsets[:-1], lengths)
+        ids = self.ids[starts + np.arange(offsets[-1])]
+
+        targets = None if self.targets is None else self.targets[indices]
+
+        return IndexedBatch([self.structures[i] for i in indices],
+                            ids, offsets, targets)
+
+
+def prefetch(iterable, depth=2):
+    """Iterate over iterable in a background thread
+
+    Up to depth items are produced ahead of the consumer, so that
+    preparing the next items overlaps with using the current one. An
+    exception raised while producing an item is raised again by the
+    consumer when it reaches that item.
+
+    Parameters
+    ----------
+    iterable : iterable
+    depth : int
+        the maximum number of items produced ahead (0 iterates in the
+        calling thread)
+
+    Yields
+    ------
+    the items of iterable, in order
+    """
+    if depth < 1:
+        yield from iterable
+        return
+
+    queue = Queue(depth)
+    stop = Event()
+    done = object()
+
+    def put(item):
+        # give up if the consumer is gone, rather than block forever
+        while not stop.is_set():
+            try:
+                queue.put(item, timeout=0.1)
+                return
+            except Full:
+                pass
+
+    def produce():
+        # any exception, even KeyboardInterrupt or SystemExit, ends
+        # the items with the sentinel, so the consumer never waits
+        # forever
+        try:
+            for item in iterable:
+                put((item, None))
+
+                if stop.is_set():
+                    return
+
+            put((done, None))
+        except BaseException as error:
+            put((done, error))
+
+    thread = Thread(target=produce, daemon=True)
+    thread.start()
+
+    try:
+        while True:
+            item, error = queue.get()
+
+            if item is done:
+                if error is not None:
+                    raise error
+
+                return
+
+            yield item
+    finally:
+        stop.set()
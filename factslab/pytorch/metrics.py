@@ -0,0 +1,168 @@
+import numpy as np
+from scipy.special import huber
+
+
+class RunningMetrics(object):
+    """Training metrics accumulated batch by batch
+
+    The statistics of the whole set of targets (mean, median, and
+    class log-probabilities) are computed once, and each update adds
+    the losses and target deviations of one batch to running sums, so
+    reporting the metrics takes constant time however large the
+    dataset is.
+
+    Parameters
+    ----------
+    regression_type : str
+        "linear", "robust", "robust_smooth", or "multinomial"
+    targets : numpy.array
+        all training targets
+    """
+
+    def __init__(self, regression_type, targets):
+        self.regression_type = regression_type
+
+        targets = np.asarray(targets)
+
+        if regression_type == "multinomial":
+            counts = np.bincount(targets)
+            self.logprob = np.log(counts) - np.log(np.sum(counts))
+        elif regression_type == "linear":
+            self.center = np.mean(targets)
+        else:
+            self.center = np.median(targets)
+
+        self.reset()
+
+    def reset(self):
+        """Start accumulating from scratch"""
+        self.num_batches = 0
+        self.num_targets = 0
+        self.loss_sum = 0.
+        self.baseline_sum = 0.
+
+    def update(self, loss, targets):
+        """Add one batch
+
+        Parameters
+        ----------
+        loss : float
+            the mean loss of the batch
+        targets : numpy.array
+            the targets of the batch
+        """
+        targets = np.asarray(targets)
+
+        self.num_batches += 1
+        self.num_targets += targets.shape[0]
+        self.loss_sum += loss
+        self.baseline_sum += np.sum(self._baseline_loss(targets))
+
+    def residual(self):
+        """The mean loss of the model over the batches"""
+        return self.loss_sum / self.num_batches
+
+    def total(self):
+        """The mean loss of always predicting the baseline
+
+        That is, the mean for linear regression, the median for robust
+        regression, and the class frequencies for multinomial
+        regression
+        """
+        return self.baseline_sum / self.num_targets
+
+    def proportion_explained(self):
+        """R-squared, proportion absolute error, or proportion entropy
+        explained, depending on the regression type"""
+        return 1. - (self.residual() / self.total())
+
+    def _baseline_loss(self, targets):
+        if self.regression_type == "multinomial":
+            return -self.logprob[targets]
+        elif self.regression_type == "linear":
+            return np.square(targets - self.center)
+        elif self.regression_type == "robust":
+            return np.abs(targets - self.center)
+        else:
+            return huber(1., targets - self.center)
+
+
+class EarlyStopping(object):
+    """Patience-based early stopping on a validation loss
+
+    Each update records the validation loss of the model. If it is
+    lower than the best loss so far by more than min_delta, a copy of
+    the model parameters is kept as the best model; otherwise the
+    update counts against the patience, and training should stop once
+    patience updates in a row have not improved.
+
+    Parameters
+    ----------
+    patience : int or NoneType
+        the number of updates without improvement to allow (never stop
+        if None)
+    min_delta : float
+        the smallest decrease in loss that counts as an improvement
+    """
+
+    def __init__(self, patience=None, min_delta=0.):
+        if patience is not None and patience < 1:
+            msg = 'patience must be positive'
+            raise ValueError(msg)
+
+        self.patience = patience
+        self.min_delta = min_delta
+
+        self.losses = []
+        self.best_loss = np.inf
+        self.best_state = None
+        self.bad_updates = 0
+
+    @property
+    def stopped(self):
+        """Whether patience has run out"""
+        return self.patience is not None and\
+            self.bad_updates >= self.patience
+
+    def update(self, loss, state_dict):
+        """Record one validation loss
+
+        Parameters
+        ----------
+        loss : float
+            the validation loss of the model
+        state_dict : dict(str, torch.Tensor)
+            the parameters of the model, copied if they are the best
+
+        Returns
+        -------
+        bool
+            whether the loss is an improvement
+        """
+        self.losses.append(loss)
+
+        if loss < self.best_loss - self.min_delta:
+            self.best_loss = loss
+            self.best_state = {name: tensor.detach().to('cpu', copy=True)
+                               for name, tensor in state_dict.items()}
+            self.bad_updates = 0
+
+            return True
+
+        self.bad_updates += 1
+
+        return False
+
+    def state_dict(self):
+        """The state to save in a checkpoint"""
+        return {'losses': list(self.losses),
+                'best_loss': self.best_loss,
+                'best_state': self.best_state,
+                'bad_updates': self.bad_updates}
+
+    def load_state_dict(self, state):
+        """Restore the state saved by state_dict"""
+        self.losses = list(state['losses'])
+        self.best_loss = state['best_loss']
+        self.best_state = state['best_state']
+        self.bad_updates = state['bad_updates']
@@ -3,18 +3,30 @@ import pandas as pd
 import torch
 import torch.autograd
 import torch.nn.functional as F
+import torch.distributed as dist
+import torch.multiprocessing as mp
 from torch.nn import Parameter
 from torch.nn import LSTM
 from torch.nn import MSELoss, L1Loss, SmoothL1Loss, CrossEntropyLoss
-from scipy.special import huber
 import pdb
-from random import shuffle
-from collections import Iterable
-from factslab.utility import partition
+import os
+import random
+from random import shuffle, randrange
+from tempfile import TemporaryDirectory
+from collections.abc import Iterable
+from factslab.utility import partition, chunked
 from .childsumtreelstm import *
+from .collate import flatten_sequences, pad_flat
+from .dataset import IndexedDataset, IndexedBatch, prefetch
+from .sampler import BucketBatchSampler, padding_efficiency
+from .metrics import RunningMetrics, EarlyStopping
+from .checkpoint import Checkpointer, load_checkpoint
 from torch.nn.utils.rnn import pad_packed_sequence
 from torch.nn.utils.rnn import pack_padded_sequence
+from torch.nn.utils.rnn import pad_sequence
 import sys
+import time
+import warnings
 
 
 class RNNRegression(torch.nn.Module):
@@ -68,17 +80,23 @@ class RNNRegression(torch.nn.Module):
         to output
     device : torch.device
         device(type="cpu") or device(type="cuda:0")
+    batch_size : NoneType
+        deprecated and ignored: batches of any size are run the same
+        way
     """
 
     def __init__(self, embeddings=None, embedding_size=None, vocab=None,
                  rnn_classes=LSTM, rnn_hidden_sizes=300,
                  num_rnn_layers=1, bidirectional=False, attention=False,
                  regression_hidden_sizes=[], output_size=1,
-                 device=torch.device(type="cpu"), batch_size=128):
+                 device=torch.device(type="cpu"), batch_size=None):
         super().__init__()
 
+        if batch_size is not None:
+            msg = 'batch_size is deprecated and ignored'
+            warnings.warn(msg, DeprecationWarning)
+
         self.device = device
-        self.batch_size = batch_size
         # initialize model
         self._initialize_embeddings(embeddings, vocab)
         self._initialize_rnn(rnn_classes, rnn_hidden_sizes,
@@ -158,7 +176,7 @@ class RNNRegression(torch.nn.Module):
         self._validate_parameters()
 
         output_size = self.embedding_size
-        self.rnns = []
+        self.rnns = torch.nn.ModuleList()
 
         params_zipped = zip(self.rnn_classes, self.rnn_hidden_sizes,
                             self.num_rnn_layers, self.bidirectional)
@@ -175,24 +193,16 @@ class RNNRegression(torch.nn.Module):
             output_size = hsize * 2 if bi else hsize
 
         self.rnn_output_size = output_size
-        if self.batch_size > 1:
-            self.has_batch_dim = True
-        else:
-            self.has_batch_dim = False
 
     def _initialize_regression(self, attention, hidden_sizes, output_size):
-        self.linear_maps = []
+        self.linear_maps = torch.nn.ModuleList()
 
         last_size = self.rnn_output_size
 
         self.attention = attention
 
         if self.attention:
-            if self.has_batch_dim:
-                self.attention_map = Parameter(torch.zeros(self.batch_size,
-                                                           last_size))
-            else:
-                self.attention_map = Parameter(torch.zeros(last_size))
+            self.attention_map = Parameter(torch.zeros(last_size))
 
         for h in hidden_sizes:
             linmap = torch.nn.Linear(last_size, h)
@@ -204,43 +214,35 @@ class RNNRegression(torch.nn.Module):
         linmap = linmap.to(self.device)
         self.linear_maps.append(linmap)
 
-    def forward(self, structures, targets):
+    def forward(self, structures, targets=None):
         """
         Parameters
         ----------
-        structures : iterable(object)
+        structures : iterable(object) or IndexedBatch
            the structures to be used in determining the RNNs
            composition path. Each element must correspond to the
            corresponding RNN in a cascade, or in the case of a trivial
            cascade (a single RNN followed by regression), `structures`
            must be a singleton iterable. When the relevant RNN in a
            cascade is a linear-chain RNN, the structure in the
-           corresponding position of this parameter is ignored
-        targets: list
-            A list of all the targets in the batch. This will be modified only
-            if the rnn_class is LSTM(since the order will be modified
-            during padding). Otherwise it is returned as is.
+           corresponding position of this parameter is ignored. A
+           list of trees is run through a tree RNN as a single forest.
+           An IndexedBatch carries the vocab ids of its words, so no
+           strings are looked up
+        targets: list or NoneType
+            A list of all the targets in the batch, returned as a
+            tensor; the targets of an IndexedBatch are used if None.
+            Predictions and targets are in the order of the
+            structures.
         """
 
-        try:
-            words = structures.words()
-        except AttributeError:
-            # assert all([isinstance(w, str) for w in structures])
-            words = structures
-        except AssertionError:
-            msg = "first structure in sequence must either" +\
-                  "implement a words() method or itself be" +\
-                  "a sequence of words"
-            raise ValueError(msg)
-
-        inputs, targets, lengths = self._get_inputs(words, targets)
-        inputs = self._preprocess_inputs(inputs)
-        h_all, h_last = self._run_rnns(inputs, structures, lengths)
+        h_all, h_last, lengths, structures, targets =\
+            self._encode(structures, targets)
 
         if self.attention:
-            h_last = self._run_attention(h_all)
+            h_last = self._run_attention(h_all, lengths)
         else:
-            if self.has_batch_dim:
+            if not isinstance(self.rnns[-1], ChildSumTreeLSTM):
                 h_last = self.last_timestep(h_all, lengths)
         h_last = self._run_regression(h_last)
 
@@ -248,6 +250,56 @@ class RNNRegression(torch.nn.Module):
 
         return y_hat, targets
 
+    def _encode(self, structures, targets=None):
+        """Run the RNNs on structures
+
+        Returns
+        -------
+        h_all : torch.Tensor
+            the hidden states of the last RNN, padded into one
+            batch-first tensor in the order of the structures when
+            there is more than one structure
+        h_last : torch.Tensor
+            the final state of the last RNN
+        lengths : torch.LongTensor or NoneType
+            the number of hidden states of each structure in h_all
+        structures : object
+            the structures, unwrapped from an IndexedBatch
+        targets : torch.Tensor or NoneType
+        """
+        if isinstance(structures, IndexedBatch):
+            batch = structures
+
+            if targets is None:
+                targets = batch.targets
+
+            if batch.inputs is None:
+                collated = self._collate(batch.ids, batch.offsets)
+            else:
+                collated = batch.inputs
+
+            structures = batch.structures
+        else:
+            collated = self._collate(*self._get_indices(structures))
+
+        if targets is not None:
+            targets = torch.as_tensor(targets, device=self.device)
+
+        indices, lengths, order = collated
+        inputs = self._get_inputs(indices)
+        inputs = self._preprocess_inputs(inputs)
+        h_all, h_last, lengths = self._run_rnns(inputs, structures, lengths)
+
+        if order is not None:
+            # put the sequences back in the order they were given
+            inverse = torch.empty_like(order)
+            inverse[order] = torch.arange(order.shape[0])
+
+            h_all = h_all[inverse.to(h_all.device)]
+            lengths = lengths[inverse]
+
+        return h_all, h_last, lengths, structures, targets
+
     def _run_rnns(self, inputs, structures, lengths):
         '''
             Run desired rnns
@@ -255,6 +307,10 @@ class RNNRegression(torch.nn.Module):
         for rnn, structure in zip(self.rnns, [structures]):
             if isinstance(rnn, ChildSumTreeLSTM):
                 h_all, h_last = rnn(inputs, structure)
+
+                if self._is_forest(structure):
+                    lengths = torch.tensor([h.shape[0] for h in h_all])
+                    h_all = pad_sequence(h_all, batch_first=True)
             elif isinstance(rnn, LSTM):
                 packed = pack_padded_sequence(inputs, list(lengths.data), batch_first=True)
                 h_all, (h_last, c_last) = rnn(packed)
@@ -265,25 +321,57 @@ class RNNRegression(torch.nn.Module):
                 h_all, _ = pad_packed_sequence(h_all, batch_first=True)
             inputs = h_all.squeeze()
 
-        return h_all, h_last
+        return h_all, h_last, lengths
 
-    def _run_attention(self, h_all, return_weights=False):
-        if not self.has_batch_dim:
-            att_raw = torch.mm(h_all, self.attention_map[:, None])
-            att = F.softmax(att_raw.squeeze(), dim=0)
+    @staticmethod
+    def _is_forest(structures):
+        return isinstance(structures, list) and bool(structures) and\
+            not hasattr(structures, 'words') and\
+            all([hasattr(s, 'root_idx') for s in structures])
 
-            if return_weights:
-                return att
-            else:
-                return torch.mm(att[None, :], h_all).squeeze()
-        else:
-            att_raw = torch.bmm(h_all, self.attention_map[:, :, None])
-            att = F.softmax(att_raw.squeeze(), dim=0)
+    def _run_attention(self, h_all, lengths=None, return_weights=False):
+        """Attend over the hidden states of each structure
+
+        A single weight vector scores every hidden state; the scores
+        are normalized over the states of each structure, with the
+        padding beyond its length excluded.
+
+        Parameters
+        ----------
+        h_all : torch.Tensor
+            the states of one structure (length-by-hidden), or a
+            padded batch of them (batch-by-length-by-hidden)
+        lengths : torch.LongTensor or NoneType
+            the number of states of each structure in a batch
+        return_weights : bool
+            whether to return the attention weights instead of the
+            attended states
+
+        Returns
+        -------
+        torch.Tensor
+        """
+        att_raw = torch.matmul(h_all, self.attention_map)
+
+        if h_all.dim() == 2:
+            att = F.softmax(att_raw, dim=0)
 
             if return_weights:
                 return att
             else:
-                return torch.bmm(att[:, None, :], h_all).squeeze()
+                return torch.matmul(att, h_all)
+
+        if lengths is not None:
+            steps = torch.arange(h_all.shape[1], device=h_all.device)
+            padding = steps[None, :] >= lengths.to(h_all.device)[:, None]
+            att_raw = att_raw.masked_fill(padding, float('-inf'))
+
+        att = F.softmax(att_raw, dim=1)
+
+        if return_weights:
+            return att
+        else:
+            return torch.bmm(att[:, None, :], h_all).squeeze(1)
 
     def _run_regression(self, h_last):
         for i, linear_map in enumerate(self.linear_maps):
@@ -304,25 +392,30 @@ class RNNRegression(torch.nn.Module):
         """
         return inputs
 
-    def _pad_inputs(self, data, targets):
+    def _pad_inputs(self, data):
         """
             Pad input sequences so that each minibatch has same length
+
+        Parameters
+        ----------
+        data : list(list(int)) or tuple(numpy.array, numpy.array)
+            the index sequences, or a flat index array and its offsets
+
+        Returns
+        -------
+        padded : torch.LongTensor
+            the sequences sorted by decreasing length, padded with 0
+        lengths : torch.LongTensor
+            the sorted lengths
+        order : torch.LongTensor
+            the sequence in each row of padded
         """
-        seq_len = torch.from_numpy(np.array([len(x) for x in data]))
-        sorted_seq_len, sorted_idx = seq_len.sort(descending=True)
-        sorted_data = torch.zeros((2,), dtype=torch.long, device=self.device)
-        sorted_data = sorted_data.new_full((len(data), sorted_seq_len[0]),
-                                      fill_value=0)
-        sorted_targets = torch.zeros((2,), dtype=torch.long, device=self.device)
-        sorted_targets = sorted_targets.new_full((len(targets),), fill_value=0,
-                                         dtype=torch.float, device=self.device)
-        m = 0
-        for x in sorted_idx:
-            sorted_data[m][0:len(data[x])] = torch.tensor(data[x], dtype=torch.long)
-            sorted_targets[m] = targets[x]
-            m += 1
-
-        return sorted_data, sorted_targets, sorted_seq_len
+        if isinstance(data, tuple):
+            flat, offsets = data
+        else:
+            flat, offsets = flatten_sequences(data)
+
+        return pad_flat(flat, offsets, self.device)
 
     def _postprocess_outputs(self, outputs):
         """Apply some function(s) to the output value(s)"""
@@ -333,19 +426,62 @@ class RNNRegression(torch.nn.Module):
         idx = (lengths - 1).view(-1, 1).expand(unpacked.size(0), unpacked.size(2)).unsqueeze(1).to(self.device)
         return unpacked.gather(1, idx).squeeze()
 
-    def _get_inputs(self, inputs, targets):
+    def _get_indices(self, structures):
+        """Look up the vocab ids of the words of structures
+
+        Returns
+        -------
+        ids : numpy.array(int)
+            the ids of all words, concatenated
+        offsets : numpy.array(int)
+            the ids of sequence i are ids[offsets[i]:offsets[i+1]]
+        """
+        try:
+            if self._is_forest(structures):
+                words = [tree.words() for tree in structures]
+            else:
+                words = structures.words()
+        except AttributeError:
+            # assert all([isinstance(w, str) for w in structures])
+            words = structures
+        except AssertionError:
+            msg = "first structure in sequence must either" +\
+                  "implement a words() method or itself be" +\
+                  "a sequence of words"
+            raise ValueError(msg)
+
+        if not (words and isinstance(words[0], list)):
+            words = [words]
+
+        dataset = IndexedDataset(words, self.vocab_hash)
+
+        return dataset.ids, dataset.offsets
+
+    def _collate(self, ids, offsets):
+        """Build the index tensors the RNNs run on
+
+        Returns
+        -------
+        indices : torch.LongTensor
+            the padded, length-sorted sequences for linear-chain
+            RNNs; the ids of all words for tree RNNs
+        lengths : torch.LongTensor or NoneType
+            the sorted lengths for linear-chain RNNs
+        order : torch.LongTensor or NoneType
+            the sequence in each row of indices for linear-chain RNNs
+        """
         if self.rnn_classes[0] == LSTM:
-            indices = []
-            for sent in inputs:
-                indices.append([self.vocab_hash[word] for word in sent])
-            indices, targets, lengths = self._pad_inputs(indices, targets)
-            indices = torch.tensor(indices, dtype=torch.long, device=self.device)
-            return self.embeddings(indices).squeeze(), targets, lengths
+            return self._pad_inputs((ids, offsets))
         else:
-            indices = [self.vocab_hash[word] for word in inputs]
-            indices = torch.tensor(indices, dtype=torch.long,
-                                   device=self.device)
-            return self.embeddings(indices).squeeze(), targets, None
+            indices = torch.from_numpy(ids)
+
+            if self.device.type == 'cuda':
+                indices = indices.pin_memory()
+
+            return indices.to(self.device, non_blocking=True), None, None
+
+    def _get_inputs(self, indices):
+        return self.embeddings(indices)
 
     def word_embeddings(self, words=[]):
         """Extract the tuned word embeddings
@@ -362,7 +498,9 @@ class RNNRegression(torch.nn.Module):
         pandas.DataFrame
         """
         words = words if words else self.vocab
-        embeddings = self._get_inputs(words).data.cpu().numpy()
+        ids = torch.tensor([self.vocab_hash[w] for w in words],
+                           dtype=torch.long, device=self.device)
+        embeddings = self.embeddings(ids).data.cpu().numpy()
 
         return pd.DataFrame(embeddings, index=words)
 
@@ -376,37 +514,62 @@ class RNNRegression(torch.nn.Module):
 
         Parameters
         ----------
-        structures : iterable(iterable(object))
-            a matrix of structures (independent variables) with rows
-            corresponding to a particular kind of RNN
+        structures : iterable(object) or IndexedBatch
+            the structures, as passed to forward
 
         Returns
         -------
-        pytorch.Tensor
+        list(pytorch.Tensor)
+            the attention weights of each structure
         """
-        try:
-            assert self.attention
-        except AttributeError:
+        if not self.attention:
             raise AttributeError('attention not used')
 
-        try:
-            words = structures[0].words()
-        except AttributeError:
-            assert all([isinstance(w, str)
-                        for w in structures[0]])
-            words = structures[0]
-        except AssertionError:
-            msg = "first structure in sequence must either" +\
-                  "implement a words() method or itself be" +\
-                  "a sequence of words"
-            raise ValueError(msg)
+        h_all, _, lengths, _, _ = self._encode(structures)
+
+        weights = self._run_attention(h_all, lengths, return_weights=True)
+
+        if lengths is None:
+            return [weights]
+
+        return [w[:n] for w, n in zip(weights, lengths.tolist())]
+
+
+def _fit_worker(rank, trainer, workers, init_method, path, seed, X, Y,
+                fit_kwargs):
+    dist.init_process_group('gloo', init_method=init_method, rank=rank,
+                            world_size=workers)
+    torch.set_num_threads(max(1, torch.get_num_threads() // workers))
+
+    _seed_all(seed)
+
+    try:
+        trainer.fit(X, Y, **fit_kwargs)
+
+        if not rank:
+            torch.save({'model': trainer._regression.state_dict(),
+                        'validation_losses': trainer.validation_losses},
+                       path)
+    finally:
+        dist.destroy_process_group()
 
-        inputs = self._get_inputs(words)
-        inputs = self._preprocess_inputs(inputs)
 
-        h_all, h_last = self._run_rnns(inputs, structures)
+def _hogwild_worker(rank, trainer, workers, seed, X, Y, fit_kwargs):
+    torch.set_num_threads(max(1, torch.get_num_threads() // workers))
 
-        return self._run_attention(h_all, return_weights=True)
+    # the same seed in every worker, so that the workers split the
+    # same shuffled batches between them
+    _seed_all(seed)
+
+    trainer._shard = (rank, workers)
+    trainer.fit(X, Y, **fit_kwargs)
+
+
+def _seed_all(seed):
+    """Seed python, numpy, and torch"""
+    random.seed(seed)
+    np.random.seed(seed)
+    torch.manual_seed(seed)
 
 
 class RNNRegressionTrainer(object):
@@ -427,6 +590,10 @@ class RNNRegressionTrainer(object):
         self.rnn_classes = rnn_classes
         self._continuous = regression_type != "multinomial"
         self.device = device
+        self.validation_losses = []
+
+        # (rank, workers) inside a hogwild worker
+        self._shard = None
 
     def _initialize_trainer_regression(self):
         if self._continuous:
@@ -434,10 +601,7 @@ class RNNRegressionTrainer(object):
                                              rnn_classes=self.rnn_classes,
                                              **self._init_kwargs)
         else:
-            if self.rnn_classes =='LSTM':
-                output_size = np.unique(self._Y[0]).shape[0]
-            else:
-                output_size = np.unique(self._Y).shape[0]
+            output_size = np.unique(self._targets).shape[0]
             self._regression = RNNRegression(output_size=output_size,
                                              device=self.device,
                                              rnn_classes=self.rnn_classes,
@@ -449,175 +613,771 @@ class RNNRegressionTrainer(object):
         self._regression = self._regression.to(self.device)
         self._loss_function = self._loss_function.to(self.device)
 
-    def fit(self, X, Y, batch_size=100, verbosity=1, **kwargs):
+    def fit(self, X, Y, batch_size=100, verbosity=1, max_tokens=None,
+            prefetch_depth=2, workers=1, hogwild=False,
+            checkpoint_dir=None, checkpoint_every=1000, keep_checkpoints=3,
+            resume_from=None, validation=None, eval_every=None,
+            patience=None, **kwargs):
         """Fit the LSTM regression
 
         Parameters
         ----------
         X : iterable(iterable(object))
-            a matrix of structures (independent variables) with rows
-            corresponding to a particular kind of RNN
+            minibatches of structures, or structures if max_tokens is
+            given
         Y : numpy.array(Number)
-            a matrix of dependent variables
+            the targets of each minibatch, or targets if max_tokens
+            is given
         batch_size : int (default: 100)
         verbosity : int (default: 1)
             how often to print metrics (never if 0)
+        max_tokens : int or NoneType (default: None)
+            if given, the structures are grouped into batches of
+            similar length by a BucketBatchSampler with this token
+            budget, rebuilt every epoch
+        prefetch_depth : int (default: 2)
+            how many batches to prepare ahead in a background thread
+            (0 prepares each batch when it is needed)
+        workers : int (default: 1)
+            the number of processes to train in, data-parallel (see
+            _fit_distributed)
+        hogwild : bool (default: False)
+            whether the workers update shared parameters without
+            synchronizing (see _fit_hogwild)
+        checkpoint_dir : str or NoneType (default: None)
+            if given, the training state is saved to this directory in
+            the background every checkpoint_every steps and at the end
+            of training (see Checkpointer)
+        checkpoint_every : int (default: 1000)
+            the number of steps between checkpoints
+        keep_checkpoints : int (default: 3)
+            the number of most recent checkpoints to keep
+        resume_from : str or NoneType (default: None)
+            a checkpoint, or a directory of checkpoints whose most
+            recent one is used, to resume training from. The model,
+            optimizer, random number generators, and the order of the
+            batches are restored, so training goes on from the step
+            after the checkpoint. X, Y, and the other arguments must be
+            the same as for the run that saved it
+        validation : tuple or NoneType (default: None)
+            held-out structures and their targets, as for evaluate. If
+            given, the validation loss is computed every eval_every
+            steps, and the model with the lowest validation loss is
+            the one left in the trainer when fit returns. The losses
+            are kept in the validation_losses attribute
+        eval_every : int or NoneType (default: None)
+            the number of steps between evaluations (at the end of
+            every epoch if None)
+        patience : int or NoneType (default: None)
+            stop training after this many evaluations in a row without
+            improvement (never stop early if None)
         """
+        if hogwild and workers > 1 and validation is not None:
+            msg = 'early stopping is not supported with hogwild training'
+            raise ValueError(msg)
 
-        self._X, self._Y = X, Y
+        fit_kwargs = dict(batch_size=batch_size, verbosity=verbosity,
+                          max_tokens=max_tokens,
+                          prefetch_depth=prefetch_depth,
+                          checkpoint_dir=checkpoint_dir,
+                          checkpoint_every=checkpoint_every,
+                          keep_checkpoints=keep_checkpoints,
+                          resume_from=resume_from, validation=validation,
+                          eval_every=eval_every, patience=patience,
+                          **kwargs)
+
+        if workers > 1 and hogwild:
+            self._fit_hogwild(workers, X, Y, **fit_kwargs)
+            return
+        elif workers > 1:
+            self._fit_distributed(workers, X, Y, **fit_kwargs)
+            return
+
+        # inside a process group (from _fit_distributed or a launcher
+        # like torchrun), each process trains on its share of the
+        # batches and gradients are averaged over processes; a hogwild
+        # worker trains on its share of the batches alone
+        distributed = dist.is_available() and dist.is_initialized()
+
+        if distributed:
+            rank, world_size = dist.get_rank(), dist.get_world_size()
+        elif self._shard is not None:
+            rank, world_size = self._shard
+        else:
+            rank, world_size = 0, 1
 
-        self._initialize_trainer_regression()
+        if rank:
+            verbosity = 0
+
+        self._set_training_data(X, Y, max_tokens)
+
+        if resume_from is None:
+            checkpoint = None
+        else:
+            checkpoint = load_checkpoint(resume_from)
+
+        # hogwild workers train the model they were given, which
+        # _fit_hogwild has already restored
+        if self._shard is None:
+            self._initialize_trainer_regression()
+
+            if checkpoint is not None:
+                self._regression.load_state_dict(checkpoint['model'])
+
+        if distributed:
+            for tensor in self._regression.state_dict().values():
+                dist.broadcast(tensor, 0)
 
         optimizer = self._optimizer_class(self._regression.parameters(),
                                           **kwargs)
 
-        if not self._continuous:
-            Y_counts = np.bincount([y for batch in self._Y for y in batch])
-            self._Y_logprob = np.log(Y_counts) - np.log(np.sum(Y_counts))
-
-        # each element is of the form ((struct1, struct2, ...),
-        #                              target)
-        structures_targets = list(zip(self._X, self._Y))
-        loss_trace = []
-        targ_trace = []
-        epoch = 0
-        while epoch < self.epochs:
+        # only the first process writes checkpoints
+        if checkpoint_dir is None or rank:
+            checkpointer = None
+        else:
+            checkpointer = Checkpointer(checkpoint_dir, keep_checkpoints)
+
+        # the processes hold the same synchronized model, so only the
+        # first one evaluates it, and tells the others whether to stop
+        if validation is None:
+            stopping = None
+        else:
+            stopping = EarlyStopping(patience)
+
+        # the words of the validation data are mapped to ids once, not
+        # at every evaluation
+        if validation is None or rank:
+            validation_set = None
+        else:
+            validation_set = IndexedDataset(validation[0],
+                                            self._regression.vocab_hash,
+                                            validation[1])
+
+        stopped = stopping is not None and stopping.stopped
+
+        metrics = RunningMetrics(self._regression_type, self._targets)
+
+        # the words are mapped to ids once; each batch is a list of
+        # positions in the dataset
+        if max_tokens is None:
+            dataset, batches = self._index_batches(self._X, self._Y)
+            sampler = None
+
+            # the same minibatches come back every epoch, so tree RNNs
+            # keep the forest plan of each one
+            self._cache_forests(len(batches))
+        else:
+            dataset = IndexedDataset(X, self._regression.vocab_hash, Y)
+            # seeded from random, so that processes seeded alike
+            # draw the same batches
+            sampler = BucketBatchSampler(dataset.lengths, max_tokens,
+                                         seed=randrange(2 ** 31))
+
+        epoch, position, step, order = 0, 0, 0, None
+        resumed = checkpoint is not None
+
+        if resumed:
+            optimizer.load_state_dict(checkpoint['optimizer'])
+            self._set_rng_state(checkpoint['rng'], sampler)
+
+            if stopping is not None:
+                stopping.load_state_dict(checkpoint['early_stopping'])
+                stopped = stopping.stopped
+
+            # the interrupted epoch goes on in the saved batch order
+            epoch = checkpoint['epoch'] - 1
+            position = checkpoint['position']
+            step = checkpoint['step']
+            order = checkpoint['order']
+
+            if sampler is None:
+                batches = order
+
+        total = position
+
+        while epoch < self.epochs and not stopped:
             epoch += 1
-            print("Epoch:", epoch, "\n")
-            print("Progress" + "\t Metrics")
-            losses = []
-
-            shuffle(structures_targets)
-            total = len(self._Y)
-            # part = partition(structures_targets, batch_size)
-            for i, structs_targs_batch in enumerate(structures_targets):
+
+            if not rank:
+                print("Epoch:", epoch, "\n")
+
+            # order holds every batch of the epoch, and shard the
+            # batches of this process
+            if resumed:
+                resumed = False
+            elif sampler is None:
+                shuffle(batches)
+                order = batches
+            else:
+                order = list(sampler)
+
+            if distributed:
+                # every process takes the same number of steps
+                steps = len(order) // world_size
+            else:
+                steps = len(order)
+
+            shard = order[rank::world_size][:steps]
+
+            if verbosity and self.rnn_classes == LSTM:
+                efficiency = padding_efficiency(dataset.lengths, shard)
+                print("Padding efficiency:", np.round(efficiency, 3), "\n")
+
+            if not rank:
+                print("Progress" + "\t Metrics")
+
+            total = len(shard)
+            start = time.perf_counter()
+
+            # the next batches are collated in the background while
+            # the model runs on the current one
+            prepared = (self._prepare_batch(dataset, batch_idx)
+                        for batch_idx in shard[position:])
+
+            for i, (batch, targs) in enumerate(prefetch(prepared,
+                                                        prefetch_depth),
+                                               position):
                 optimizer.zero_grad()
-                if self.rnn_classes == LSTM:
-                    structs, targs = structs_targs_batch
-
-                    targ_trace += list(targs)
-
-                    if self._continuous:
-                        targs = torch.tensor(targs, dtype=torch.float)
-                    else:
-                        targs = torch.tensor(int(targ), dtype=torch.long)
-
-                    targs = targs.to(self.device)
-                    predicted, targs = self._regression(structs, targs)
-                    if self._continuous:
-                        loss = self._loss_function(predicted, targs)
-                    else:
-                        loss = self._loss_function(predicted[None, :], targs)
-                    losses.append(loss)
-                else:
-                    structs_targs = list(zip(structs_targs_batch[0],
-                                             structs_targs_batch[1]))
-                    for struct, targ in structs_targs:
-                        targ_trace.append(targ)
-
-                        if self._continuous:
-                            targ = torch.tensor([targ], dtype=torch.float)
-                        else:
-                            targ = torch.tensor([int(targ)], dtype=torch.long)
-
-                        targ = targ.to(self.device)
-                        predicted, targ = self._regression(struct, targ)
-                        if self._continuous:
-                            loss = self._loss_function(predicted, targ)
-                        else:
-                            loss = self._loss_function(predicted[None, :], targ)
-
-                        losses.append(loss)
-
-                loss = sum(losses) / len(losses)
+
+                # linear-chain RNNs run the batch padded, tree RNNs as a
+                # single forest; either way there is one loss per step
+                predicted, targs = self._regression(batch, targs)
+                loss = self._batch_loss(predicted, targs)
                 loss.backward()
 
+                if distributed:
+                    self._average_gradients(world_size)
+
                 optimizer.step()
-                losses = []
-                loss_trace.append(loss.item())
+                step += 1
+
+                if eval_every is None:
+                    evaluate_now = i + 1 == total
+                else:
+                    evaluate_now = not step % eval_every
+
+                if stopping is not None and evaluate_now:
+                    if not rank:
+                        self._validate(validation_set, stopping,
+                                       prefetch_depth, verbosity)
+                        stopped = stopping.stopped
+
+                    if distributed:
+                        stopped = self._broadcast_flag(stopped)
+
+                if checkpointer is not None and not step % checkpoint_every:
+                    state = self._checkpoint_state(optimizer, sampler,
+                                                   epoch, i + 1, step,
+                                                   order, stopping)
+                    checkpointer.save(state, step)
+
+                metrics.update(loss.item(), batch.targets)
                 # TODO: generalize for non-linear regression
                 if verbosity:
                     if not i % verbosity:
                         progress = "{:.4f}".format(((i) / total) * 100)
-                        self._print_metric(progress, loss_trace, targ_trace)
-                        loss_trace = []
-                        targ_trace = []
+                        self._print_metric(progress, metrics)
+                        metrics.reset()
 
-    def _print_metric(self, progress, loss_trace, targ_trace):
+                if stopped:
+                    if not rank:
+                        print("Stopping early after", step, "steps\n")
 
-        sigdig = 3
-        Y_flat = [y for batch in self._Y for y in batch]
-        if self._continuous:
-            resid_mean = np.mean(loss_trace)
+                    break
+
+            if verbosity:
+                seconds = time.perf_counter() - start
+                print("Throughput:", np.round((total - position) / seconds,
+                                              2),
+                      "batches/sec\n")
+
+            position = 0
+
+        if checkpointer is not None:
+            # the end of training, unless it was just saved
+            if order is not None and step % checkpoint_every:
+                state = self._checkpoint_state(optimizer, sampler, epoch,
+                                               total, step, order, stopping)
+                checkpointer.save(state, step)
+
+            checkpointer.wait()
+
+        self._cache_forests(0)
+
+        if stopping is not None and stopping.best_state is not None:
+            self._regression.load_state_dict(stopping.best_state)
+
+        self.validation_losses = [] if stopping is None else stopping.losses
+
+    def _validate(self, validation_set, stopping, prefetch_depth,
+                  verbosity=1):
+        """Evaluate on the validation set and update stopping"""
+        loss = self.evaluate(validation_set, prefetch_depth=prefetch_depth)
+        improved = stopping.update(loss, self._regression.state_dict())
+
+        if verbosity:
+            print("Validation loss:", np.round(loss, 3),
+                  "(best)" if improved else "", "\n")
+
+    @staticmethod
+    def _broadcast_flag(flag):
+        """The value of flag in the first process, in every process"""
+        flag = torch.tensor([int(flag)])
+        dist.broadcast(flag, 0)
+
+        return bool(flag.item())
+
+    def evaluate(self, X, Y=None, batch_size=1024, max_tokens=None,
+                 prefetch_depth=2):
+        """The mean loss of the LSTM regression on held-out data
 
-            if self._regression_type == "linear":
-                targ_var = np.mean(np.square(np.array(targ_trace) - np.mean(Y_flat)))
-                r2 = 1. - (resid_mean / targ_var)
-                print(progress + "%" + '\t\t residual variance:\t', np.round(resid_mean, sigdig), '\n',
-                      ' \t\t total variance:\t', np.round(targ_var, sigdig), '\n',
-                      ' \t\t r-squared:\t\t', np.round(r2, sigdig), '\n')
+        This runs through the same batched path as predict, without
+        autograd.
 
-            elif self._regression_type == "robust":
-                ae = np.abs(targ_trace - np.median(Y_flat))
-                mae = np.mean(ae)
-                pmae = 1. - (resid_mean / mae)
+        Parameters
+        ----------
+        X : iterable(object) or IndexedDataset
+            the structures to evaluate on, or a dataset of them built
+            with their targets, which is evaluated as is
+        Y : iterable(Number) or NoneType
+            the target of each structure (ignored for a dataset)
+        batch_size, max_tokens, prefetch_depth
+            as for predict
+
+        Returns
+        -------
+        float
+        """
+        if isinstance(X, IndexedDataset):
+            dataset = X
+        else:
+            dataset = IndexedDataset(X, self._regression.vocab_hash, Y)
+
+        def evaluate_batch(batch):
+            predicted, _ = self._regression(batch)
+            targets = self._target_tensor(batch.targets)
+            loss = self._batch_loss(predicted, targets)
+
+            return loss.item() * len(batch)
 
-                print(progress + "%" + '\t\t residual absolute error:\t', np.round(resid_mean, sigdig), '\n',
-                      ' \t\t total absolute error:\t\t', np.round(mae, sigdig), '\n',
-                      ' \t\t proportion absolute error:\t', np.round(pmae, sigdig), '\n')
+        total = sum(loss for _, loss in self._infer(dataset, evaluate_batch,
+                                                    batch_size, max_tokens,
+                                                    prefetch_depth))
 
-            elif self._regression_type == "robust_smooth":
-                ae = huber(1., targ_trace - np.median(Y_flat))
-                mae = np.mean(ae)
-                pmae = 1. - (resid_mean / mae)
+        return total / len(dataset)
 
-                print(progress + "%" + '\t\t residual absolute error:\t', np.round(resid_mean, sigdig), '\n',
-                      ' \t\t total absolute error:\t\t', np.round(mae, sigdig), '\n',
-                      ' \t\t proportion absolute error:\t', np.round(pmae, sigdig), '\n')
+    def _checkpoint_state(self, optimizer, sampler, epoch, position, step,
+                          order, stopping=None):
+        """Everything needed to resume training after a step
 
+        Parameters
+        ----------
+        optimizer : torch.optim.Optimizer
+        sampler : BucketBatchSampler or NoneType
+        epoch : int
+            the current epoch, counting from 1
+        position : int
+            the number of batches of the epoch this process has done
+        step : int
+            the number of steps taken since training started
+        order : list(numpy.array(int))
+            the batches of the epoch, before they are split between
+            processes
+        stopping : EarlyStopping or NoneType
+        """
+        rng = {'python': random.getstate(),
+               'numpy': np.random.get_state(),
+               'torch': torch.get_rng_state(),
+               'sampler': None if sampler is None else
+               sampler.state_dict()}
+
+        if self.device.type == 'cuda':
+            rng['cuda'] = torch.cuda.get_rng_state_all()
+
+        return {'model': self._regression.state_dict(),
+                'optimizer': optimizer.state_dict(),
+                'epoch': epoch,
+                'position': position,
+                'step': step,
+                'order': list(order),
+                'rng': rng,
+                'early_stopping': None if stopping is None else
+                stopping.state_dict()}
+
+    def _set_rng_state(self, rng, sampler=None):
+        """Restore random number generators saved by _checkpoint_state"""
+        random.setstate(rng['python'])
+        np.random.set_state(rng['numpy'])
+        torch.set_rng_state(rng['torch'])
+
+        if sampler is not None:
+            sampler.load_state_dict(rng['sampler'])
+
+        if 'cuda' in rng and self.device.type == 'cuda':
+            torch.cuda.set_rng_state_all(rng['cuda'])
+
+    def _set_training_data(self, X, Y, max_tokens=None):
+        """Keep the training data and all of its targets in one array
+
+        Y holds the targets of each minibatch, or the targets
+        themselves if max_tokens is given (see fit)
+        """
+        self._X, self._Y = X, Y
+
+        if max_tokens is None:
+            self._targets = np.array([y for targs in Y for y in targs])
         else:
-            model_mean_neglogprob = np.mean(loss_trace)
-            targ_mean_neglogprob = -np.mean([self._Y_logprob[x] for x in targ_trace])
-            pnlp = 1. - (model_mean_neglogprob / targ_mean_neglogprob)
+            self._targets = np.asarray(Y)
+
+    def _fit_distributed(self, workers, X, Y, **fit_kwargs):
+        """Fit in workers processes with data-parallel SGD
+
+        Each process is started on this machine, joins a gloo process
+        group, and runs fit on the same data with the same seed: the
+        parameters are synchronized from the first process, each
+        process trains on every workers-th batch of each epoch, and
+        gradients are averaged over processes after every step. The
+        torch threads of the machine are split between the processes.
+        Only the first process evaluates on validation data. When all
+        are done, the model and validation losses of the first process
+        are loaded into this trainer.
+        """
+        with TemporaryDirectory() as tmpdir:
+            init_method = 'file://' + os.path.join(tmpdir, 'rendezvous')
+            path = os.path.join(tmpdir, 'model.pt')
+            seed = randrange(2 ** 31)
 
-            print(progress + "%" + '\t\t residual mean cross entropy:\t', np.round(model_mean_neglogprob, sigdig), '\n',
-                  ' \t\t total mean cross entropy:\t', np.round(targ_mean_neglogprob, sigdig), '\n',
-                  ' \t\t proportion entropy explained:\t', np.round(pnlp, sigdig), '\n')
+            mp.spawn(_fit_worker,
+                     args=(self, workers, init_method, path, seed,
+                           X, Y, fit_kwargs),
+                     nprocs=workers, join=True)
 
-    def predict(self, X):
-        """Predict using the LSTM regression
+            state = torch.load(path)
+
+        self._set_training_data(X, Y, fit_kwargs.get('max_tokens'))
+
+        self._initialize_trainer_regression()
+        self._regression.load_state_dict(state['model'])
+
+        self.validation_losses = state['validation_losses']
+
+    def _fit_hogwild(self, workers, X, Y, **fit_kwargs):
+        """Fit in workers processes updating shared parameters
+
+        The model is built here and its parameters are moved to shared
+        memory. Each process then runs fit on every workers-th batch
+        of each epoch (with its own optimizer) and updates the shared
+        parameters without any locking or synchronization, as in
+        Hogwild! (Recht et al. 2011). Since nothing waits on anything
+        else, irregular batches (e.g. forests of trees of different
+        sizes) do not hold up the other workers. Only CPU training is
+        supported. When resuming, the model is restored here and every
+        worker starts from the optimizer state of the first worker,
+        which is the one that writes checkpoints.
+        """
+        if self.device.type != 'cpu':
+            msg = 'hogwild training is only supported on the cpu'
+            raise ValueError(msg)
+
+        self._set_training_data(X, Y, fit_kwargs.get('max_tokens'))
+
+        self._initialize_trainer_regression()
+
+        if fit_kwargs.get('resume_from') is not None:
+            checkpoint = load_checkpoint(fit_kwargs['resume_from'])
+            self._regression.load_state_dict(checkpoint['model'])
+
+        self._regression.share_memory()
+
+        mp.spawn(_hogwild_worker,
+                 args=(self, workers, randrange(2 ** 31), X, Y, fit_kwargs),
+                 nprocs=workers, join=True)
+
+    def _cache_forests(self, maxsize):
+        """Set how many forest plans the tree RNNs keep"""
+        for rnn in self._regression.rnns:
+            if isinstance(rnn, ChildSumTreeLSTM):
+                rnn.cache_forests(maxsize)
+
+    def _average_gradients(self, world_size):
+        """All-reduce the gradients of every parameter in one call"""
+        parameters = list(self._regression.parameters())
+        grads = [p.grad if p.grad is not None else torch.zeros_like(p)
+                 for p in parameters]
+
+        flat = torch.cat([g.reshape(-1) for g in grads])
+        dist.all_reduce(flat)
+        flat /= world_size
+
+        offset = 0
+
+        for p in parameters:
+            n = p.numel()
+            p.grad = flat[offset:offset + n].view_as(p).clone()
+            offset += n
+
+    def _batch_loss(self, predicted, targets):
+        """The loss of a whole batch in one call
+
+        Predictions are reshaped to a vector for continuous regression
+        and to a batch-by-class matrix for multinomial regression,
+        since the model squeezes away a batch dimension of size one.
+        """
+        if self._continuous:
+            return self._loss_function(predicted.reshape(-1),
+                                       targets.reshape(-1))
+        else:
+            return self._loss_function(
+                predicted.reshape(targets.shape[0], -1), targets)
+
+    def _prepare_batch(self, dataset, batch_idx):
+        """Gather, collate, and move to the device one minibatch
+
+        Returns
+        -------
+        batch : IndexedBatch
+            with its model inputs collated
+        targets : torch.Tensor or NoneType
+            the targets of the batch on the device, if it has any
+        """
+        batch = dataset.batch(batch_idx)
+        batch.inputs = self._regression._collate(batch.ids, batch.offsets)
+
+        if batch.targets is None:
+            return batch, None
+
+        return batch, self._target_tensor(batch.targets)
+
+    def _target_tensor(self, targets):
+        """Targets as a tensor of the loss function's type on the device"""
+        dtype = torch.float if self._continuous else torch.long
+        targets = torch.as_tensor(targets, dtype=dtype)
+
+        if self.device.type == 'cuda':
+            targets = targets.pin_memory()
+
+        return targets.to(self.device, non_blocking=True)
+
+    def _index_batches(self, X, Y=None):
+        """Build an IndexedDataset from minibatches of structures
 
         Parameters
         ----------
         X : iterable(iterable(object))
-            a matrix of structures (independent variables) with rows
-            corresponding to a particular kind of RNN
+            minibatches of structures
+        Y : iterable(iterable(Number)) or NoneType
+            the targets of each minibatch
+
+        Returns
+        -------
+        dataset : IndexedDataset
+        batches : list(numpy.array(int))
+            the positions in dataset of each minibatch
+        """
+        X = [list(structs) for structs in X]
+        sizes = np.cumsum([0] + [len(structs) for structs in X])
+
+        structures = [s for structs in X for s in structs]
+        targets = None if Y is None else [y for targs in Y for y in targs]
+
+        dataset = IndexedDataset(structures, self._regression.vocab_hash,
+                                 targets)
+        batches = [np.arange(start, end)
+                   for start, end in zip(sizes[:-1], sizes[1:])]
+
+        return dataset, batches
+
+    def _print_metric(self, progress, metrics):
+
+        sigdig = 3
+        resid_mean = metrics.residual()
+        total = metrics.total()
+        explained = metrics.proportion_explained()
+
+        if self._regression_type == "linear":
+            print(progress + "%" + '\t\t residual variance:\t', np.round(resid_mean, sigdig), '\n',
+                  ' \t\t total variance:\t', np.round(total, sigdig), '\n',
+                  ' \t\t r-squared:\t\t', np.round(explained, sigdig), '\n')
+
+        elif self._regression_type in ["robust", "robust_smooth"]:
+            print(progress + "%" + '\t\t residual absolute error:\t', np.round(resid_mean, sigdig), '\n',
+                  ' \t\t total absolute error:\t\t', np.round(total, sigdig), '\n',
+                  ' \t\t proportion absolute error:\t', np.round(explained, sigdig), '\n')
+
+        else:
+            print(progress + "%" + '\t\t residual mean cross entropy:\t', np.round(resid_mean, sigdig), '\n',
+                  ' \t\t total mean cross entropy:\t', np.round(total, sigdig), '\n',
+                  ' \t\t proportion entropy explained:\t', np.round(explained, sigdig), '\n')
+
+    def predict(self, X, batch_size=1024, max_tokens=None,
+                prefetch_depth=2):
+        """Predict using the LSTM regression
+
+        Inference runs without autograd, in batches: sequences of
+        similar length are batched together for linear-chain RNNs,
+        and consecutive trees are run as one forest for tree RNNs.
+        Predictions are written into one preallocated array in the
+        order of X.
+
+        Parameters
+        ----------
+        X : iterable(object)
+            the structures to predict for
+        batch_size : int (default: 1024)
+            the maximum number of structures in a batch
+        max_tokens : int or NoneType (default: None)
+            the maximum padded size of a batch for linear-chain RNNs
+        prefetch_depth : int (default: 2)
+            how many batches to prepare ahead in a background thread
+
+        Returns
+        -------
+        numpy.array
+            the predicted value of each structure, or its most probable
+            class for multinomial regression
         """
+        dataset = IndexedDataset(X, self._regression.vocab_hash)
+
+        output_size = self._regression.linear_maps[-1].out_features
+        outputs = np.empty((len(dataset), output_size), dtype=np.float32)
+
+        def predict_batch(batch):
+            predicted, _ = self._regression(batch)
 
-        predictions = [self._regression(struct) for struct in zip(*X)]
+            return predicted.reshape(len(batch), output_size).cpu().numpy()
+
+        for batch_idx, predicted in self._infer(dataset, predict_batch,
+                                                batch_size, max_tokens,
+                                                prefetch_depth):
+            outputs[batch_idx] = predicted
 
         if self._continuous:
-            return np.array([p.data.cpu().numpy() for p in predictions])
+            return outputs.squeeze(axis=1)
         else:
-            dist = np.array([p.data.cpu().numpy() for p in predictions])
-            return np.where(dist == np.max(dist, axis=1)[:, None])
+            return np.argmax(outputs, axis=1)
+
+    def predict_iter(self, X, chunk_size=65536, **kwargs):
+        """Predict for a stream of structures, chunk by chunk
+
+        At most chunk_size structures are held at once, so X can be a
+        generator over a corpus larger than memory. Each chunk can be
+        written out as it arrives (see factslab.utility.save_shards).
+
+        Parameters
+        ----------
+        X : iterable(object)
+            the structures to predict for
+        chunk_size : int (default: 65536)
+            the number of structures per chunk
+        kwargs
+            passed to predict
+
+        Yields
+        ------
+        numpy.array
+            the predictions for the next chunk_size structures (fewer
+            for the last chunk)
+        """
+        for chunk in chunked(X, chunk_size):
+            yield self.predict(chunk, **kwargs)
+
+    def attention_iter(self, X, chunk_size=65536, batch_size=1024,
+                       max_tokens=None, prefetch_depth=2):
+        """Compute attention weights for a stream of structures
+
+        Parameters
+        ----------
+        X : iterable(object)
+            the structures to compute attention weights for
+        chunk_size : int (default: 65536)
+            the number of structures per chunk
+        batch_size, max_tokens, prefetch_depth
+            as for predict
+
+        Yields
+        ------
+        numpy.array
+            a chunk_size-by-longest structure matrix of the attention
+            weights of the next chunk_size structures, padded with NaN
+        """
+        def attend_batch(batch):
+            return [w.cpu().numpy()
+                    for w in self._regression.attention_weights(batch)]
+
+        for chunk in chunked(X, chunk_size):
+            dataset = IndexedDataset(chunk, self._regression.vocab_hash)
+            weights = [None] * len(dataset)
+
+            for batch_idx, batch_weights in self._infer(dataset,
+                                                        attend_batch,
+                                                        batch_size,
+                                                        max_tokens,
+                                                        prefetch_depth):
+                for i, w in zip(batch_idx, batch_weights):
+                    weights[i] = w
+
+            longest = max([w.shape[0] for w in weights])
+            padded = np.full((len(weights), longest), np.nan,
+                             dtype=np.float32)
+
+            for i, w in enumerate(weights):
+                padded[i, :w.shape[0]] = w
+
+            yield padded
 
     def attention_weights(self, X):
         """Compute what the LSTM regression is attending to
 
         Parameters
         ----------
-        X : iterable(iterable(object))
-            a matrix of structures (independent variables) with rows
-            corresponding to a particular kind of RNN
+        X : iterable(object)
+            the structures to compute attention weights for
 
         Returns
         -------
         list(np.array)
         """
-        attention = [self._regression.attention_weights(struct)
-                     for struct in zip(*X)]
-        return [a.data.cpu().numpy() for a in attention]
+        return [row[~np.isnan(row)]
+                for padded in self.attention_iter(X)
+                for row in padded]
+
+    def _infer(self, dataset, run_batch, batch_size, max_tokens,
+               prefetch_depth):
+        """Run run_batch on batches of dataset without autograd
+
+        Yields
+        ------
+        batch_idx : numpy.array(int)
+            the positions in dataset of the batch
+        result : object
+            the result of run_batch on the batch
+        """
+        if self.rnn_classes == LSTM:
+            batches = list(BucketBatchSampler(dataset.lengths, max_tokens,
+                                              max_batch_size=batch_size,
+                                              shuffle=False))
+        else:
+            batches = [np.arange(start, min(start + batch_size, len(dataset)))
+                       for start in range(0, len(dataset), batch_size)]
+
+        prepared = (self._prepare_batch(dataset, batch_idx)
+                    for batch_idx in batches)
+
+        # in eval mode, tree RNNs do not cache forest plans, so the
+        # trees of a stream of batches are not kept alive
+        training = self._regression.training
+        self._regression.eval()
+
+        try:
+            for batch_idx, (batch, _) in zip(batches,
+                                             prefetch(prepared,
+                                                      prefetch_depth)):
+                with torch.inference_mode():
+                    result = run_batch(batch)
+
+                yield batch_idx, result
+        finally:
+            self._regression.train(training)
 
     def word_embeddings(self, words=[]):
         """Extract the tuned word embeddings
@@ -0,0 +1,131 @@
+import numpy as np
+
+
+def padding_efficiency(lengths, batches):
+    """The proportion of padded positions that hold real tokens
+
+    Each batch is padded to the length of its longest sequence, so
+    this is the number of tokens divided by the sum over batches of
+    batch size times longest length.
+
+    Parameters
+    ----------
+    lengths : numpy.array(int)
+        the length of every sequence
+    batches : iterable(iterable(int))
+        the sequences in each batch
+
+    Returns
+    -------
+    float
+    """
+    lengths = np.asarray(lengths)
+
+    tokens, padded = 0, 0
+
+    for batch in batches:
+        batch_lengths = lengths[np.asarray(batch, dtype=np.int64)]
+
+        tokens += batch_lengths.sum()
+        padded += batch_lengths.shape[0] * batch_lengths.max()
+
+    return float(tokens) / padded if padded else 1.
+
+
+class BucketBatchSampler(object):
+    """Batches of sequences of similar length under a token budget
+
+    Each epoch, the sequences are sorted by length, with sequences of
+    equal length in random order, and cut into batches whose padded
+    size (batch size times longest length) is at most max_tokens.
+    The order of the batches is then shuffled. Since each batch
+    contains sequences of nearly equal length, little of the padded
+    batch is padding.
+
+    Parameters
+    ----------
+    lengths : iterable(int)
+        the length of every sequence
+    max_tokens : int or NoneType
+        the maximum padded size of a batch; a sequence longer than
+        max_tokens gets a batch of its own. If None, only
+        max_batch_size limits the batches
+    max_batch_size : int or NoneType
+        the maximum number of sequences in a batch
+    shuffle : bool
+        whether to shuffle within and across buckets
+    seed : int or NoneType
+    """
+
+    def __init__(self, lengths, max_tokens=4096, max_batch_size=None,
+                 shuffle=True, seed=None):
+        self.lengths = np.asarray(lengths, dtype=np.int64)
+        self.max_tokens = max_tokens
+        self.max_batch_size = max_batch_size
+        self.shuffle = shuffle
+
+        self._rng = np.random.RandomState(seed)
+
+        if max_tokens is not None and max_tokens < 1:
+            msg = 'max_tokens must be positive'
+            raise ValueError(msg)
+
+        # the cuts only depend on the sorted lengths, which are the
+        # same every epoch
+        self._bounds = self._cut(np.sort(self.lengths, kind='stable'))
+
+    def __len__(self):
+        return len(self._bounds) - 1
+
+    def __iter__(self):
+        if self.shuffle:
+            ties = self._rng.permutation(self.lengths.shape[0])
+            order = np.lexsort((ties, self.lengths))
+        else:
+            order = np.argsort(self.lengths, kind='stable')
+
+        batches = [order[start:end]
+                   for start, end in zip(self._bounds[:-1],
+                                         self._bounds[1:])]
+
+        if self.shuffle:
+            batches = [batches[i]
+                       for i in self._rng.permutation(len(batches))]
+
+        return iter(batches)
+
+    def padding_efficiency(self):
+        """The padding efficiency of the batches of an epoch"""
+        return padding_efficiency(self.lengths, self)
+
+    def state_dict(self):
+        """The state to save in a checkpoint
+
+        This is the state of the random number generator, so that a
+        sampler restored with load_state_dict draws the same batches
+        in the following epochs.
+        """
+        return {'rng': self._rng.get_state()}
+
+    def load_state_dict(self, state):
+        """Restore the state saved by state_dict"""
+        self._rng.set_state(state['rng'])
+
+    def _cut(self, sorted_lengths):
+        bounds = [0]
+
+        for k, length in enumerate(sorted_lengths):
+            size = k - bounds[-1] + 1
+
+            # lengths are increasing, so length is the longest so far
+            too_many_tokens = self.max_tokens is not None and\
+                size * length > self.max_tokens
+            too_many = self.max_batch_size is not None and\
+                size > self.max_batch_size
+
+            if size > 1 and (too_many_tokens or too_many):
+                bounds.append(k)
+
+        bounds.append(sorted_lengths.shape[0])
+
+        return bounds
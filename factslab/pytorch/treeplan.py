@@ -0,0 +1,436 @@
+import numpy as np
+import torch
+from collections import OrderedDict, namedtuple
+
+
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'maxsize', 'currsize'])
+
+
+class TreePlan(object):
+    """A tree (or forest of trees) compiled into flat integer arrays
+
+    Nodes are identified by their ordinal in the tree's positions; in
+    a forest, the ordinals of each tree are offset by the number of
+    nodes in the trees preceding it, and its input rows by the number
+    of inputs of the trees preceding it.
+
+    In general, the initializer should not be used directly; rather,
+    compile_tree_plan should be used to build a plan from a tree and
+    TreePlan.concatenate to merge plans into a forest.
+
+    Attributes
+    ----------
+    child_ptr : numpy.array(int)
+        offsets into child_idx (compressed sparse row); the children
+        of node k are child_idx[child_ptr[k]:child_ptr[k+1]]
+    child_idx : numpy.array(int)
+    parent : numpy.array(int)
+        the parent of each node (-1 for nodes without a parent)
+    input_rows : numpy.array(int)
+        the row of the inputs corresponding to each node (-1 for
+        nodes that do not have an input)
+    roots : numpy.array(int)
+    root_trees : numpy.array(int)
+        the tree that each root belongs to
+    height : numpy.array(int)
+        the length of the longest path from each node to a leaf
+    depth : numpy.array(int)
+        the length of the path from each node to a root
+    sizes : list(int)
+        the number of nodes in each tree
+    num_inputs : int
+        the total number of inputs of all trees
+    """
+
+    __slots__ = ['child_ptr', 'child_idx', 'parent', 'input_rows',
+                 'roots', 'root_trees', 'height', 'depth', 'sizes',
+                 'num_inputs', '_levels']
+
+    def __init__(self, child_ptr, child_idx, parent, input_rows, roots,
+                 root_trees, height, depth, sizes, num_inputs):
+        self.child_ptr = child_ptr
+        self.child_idx = child_idx
+        self.parent = parent
+        self.input_rows = input_rows
+        self.roots = roots
+        self.root_trees = root_trees
+        self.height = height
+        self.depth = depth
+        self.sizes = sizes
+        self.num_inputs = num_inputs
+
+        self._levels = {}
+
+    @property
+    def num_nodes(self):
+        return self.parent.shape[0]
+
+    @property
+    def num_trees(self):
+        return len(self.sizes)
+
+    @classmethod
+    def concatenate(cls, plans):
+        """Merge plans into a single forest plan
+
+        Parameters
+        ----------
+        plans : list(TreePlan)
+
+        Returns
+        -------
+        TreePlan
+        """
+        if len(plans) == 1:
+            return plans[0]
+
+        node_offsets = np.cumsum([0] + [p.num_nodes for p in plans])
+        edge_offsets = np.cumsum([0] + [p.child_idx.shape[0] for p in plans])
+        input_offsets = np.cumsum([0] + [p.num_inputs for p in plans])
+        tree_offsets = np.cumsum([0] + [p.num_trees for p in plans])
+
+        def offset(arrays, offsets, keep_negative=False):
+            if keep_negative:
+                arrays = [np.where(a < 0, a, a + o)
+                          for a, o in zip(arrays, offsets)]
+            else:
+                arrays = [a + o for a, o in zip(arrays, offsets)]
+
+            return np.concatenate(arrays)
+
+        child_ptr = np.concatenate([[0]] + [p.child_ptr[1:] + o
+                                            for p, o in zip(plans,
+                                                            edge_offsets)])
+
+        return cls(child_ptr,
+                   offset([p.child_idx for p in plans], node_offsets),
+                   offset([p.parent for p in plans], node_offsets, True),
+                   offset([p.input_rows for p in plans], input_offsets, True),
+                   offset([p.roots for p in plans], node_offsets),
+                   offset([p.root_trees for p in plans], tree_offsets),
+                   np.concatenate([p.height for p in plans]),
+                   np.concatenate([p.depth for p in plans]),
+                   [s for p in plans for s in p.sizes],
+                   int(input_offsets[-1]))
+
+    def children(self):
+        """The children of each node as a list of lists"""
+        return [c.tolist()
+                for c in np.split(self.child_idx, self.child_ptr[1:-1])]
+
+    def parents(self):
+        """The parents of each node as a list of lists"""
+        return [[p] if p >= 0 else [] for p in self.parent.tolist()]
+
+    def levels(self, direction):
+        """Group nodes into levels that can be computed simultaneously
+
+        Upward, nodes are grouped by height and depend on their
+        children; downward, nodes are grouped by depth and depend on
+        their parent. The result is cached on the plan.
+
+        Parameters
+        ----------
+        direction : str
+            'up' or 'down'
+
+        Returns
+        -------
+        list(tuple(torch.Tensor))
+            for each level, in order, the ordinals of the nodes in that
+            level, the ordinals of the previous nodes (flattened), the
+            position of the dependent node within the level for each
+            previous node, and the number of previous nodes per node
+            (minimum 1)
+        """
+        if direction in self._levels:
+            return self._levels[direction]
+
+        if direction == 'up':
+            level = self.height
+            num_previous = np.diff(self.child_ptr)
+            dependent = np.repeat(np.arange(self.num_nodes), num_previous)
+            previous = self.child_idx
+        else:
+            level = self.depth
+            has_parent = self.parent >= 0
+            num_previous = has_parent.astype(np.int64)
+            dependent = np.flatnonzero(has_parent)
+            previous = self.parent[has_parent]
+
+        num_levels = int(level.max()) + 1 if self.num_nodes else 0
+        boundaries = np.arange(num_levels + 1)
+
+        node_order = np.argsort(level, kind='stable')
+        node_bounds = np.searchsorted(level[node_order], boundaries)
+
+        within = np.empty(self.num_nodes, dtype=np.int64)
+        within[node_order] = np.arange(self.num_nodes) -\
+            node_bounds[level[node_order]]
+
+        edge_level = level[dependent]
+        edge_order = np.argsort(edge_level, kind='stable')
+        edge_bounds = np.searchsorted(edge_level[edge_order], boundaries)
+
+        counts = np.maximum(num_previous, 1).astype(np.float32)
+
+        levels = []
+
+        # the tensors outlive this call, so they must not be inference
+        # tensors even if the plan is first used for inference; those
+        # could not be used by a later training step
+        with torch.inference_mode(False):
+            for l in range(num_levels):
+                nodes = node_order[node_bounds[l]:node_bounds[l + 1]]
+                edges = edge_order[edge_bounds[l]:edge_bounds[l + 1]]
+
+                levels.append((torch.from_numpy(nodes),
+                               torch.from_numpy(previous[edges]),
+                               torch.from_numpy(within[dependent[edges]]),
+                               torch.from_numpy(counts[nodes])))
+
+        self._levels[direction] = levels
+
+        return levels
+
+
+def dependency_order(previous):
+    """Generate nodes in an order in which every node comes after all
+    of the nodes it depends on
+
+    An explicit stack is used instead of recursion, so that trees of
+    arbitrary depth can be scheduled without hitting the recursion
+    limit. Each node is generated exactly once.
+
+    Parameters
+    ----------
+    previous : list(list(int))
+        the ordinals of the nodes each node depends on
+
+    Returns
+    -------
+    generator(int)
+    """
+    done = [False] * len(previous)
+
+    for start in range(len(previous)):
+        stack = [start]
+
+        while stack:
+            k = stack[-1]
+
+            if done[k]:
+                stack.pop()
+                continue
+
+            pending = [p for p in previous[k] if not done[p]]
+
+            if pending:
+                stack.extend(pending)
+            else:
+                done[k] = True
+                stack.pop()
+
+                yield k
+
+
+def _longest_paths(previous):
+    """The length of the longest path from each node to a node
+    without previous nodes"""
+
+    length = [0] * len(previous)
+
+    for k in dependency_order(previous):
+        length[k] = 1 + max([length[p] for p in previous[k]] or [-1])
+
+    return np.array(length, dtype=np.int64)
+
+
+def compile_tree_plan(tree, input_rows, num_inputs):
+    """Compile a tree into a TreePlan
+
+    Parameters
+    ----------
+    tree : ConstituencyTree or DependencyTree
+        must implement positions, root_idx, children_idx, and
+        parents_idx; every node may have at most one parent
+    input_rows : list(int)
+        the row of the inputs corresponding to each node in
+        tree.positions (-1 if the node does not have an input)
+    num_inputs : int
+        the number of inputs the tree consumes
+
+    Returns
+    -------
+    TreePlan
+    """
+    positions = tree.positions
+    ordinals = {idx: k for k, idx in enumerate(positions)}
+
+    children = [[ordinals[i] for i in tree.children_idx(idx)]
+                for idx in positions]
+    parents = [[ordinals[i] for i in tree.parents_idx(idx)]
+               for idx in positions]
+
+    if any([len(p) > 1 for p in parents]):
+        raise ValueError('every node in a tree must have at most one parent')
+
+    child_ptr = np.cumsum([0] + [len(c) for c in children])
+    child_idx = np.array([i for c in children for i in c], dtype=np.int64)
+
+    parent = np.array([p[0] if p else -1 for p in parents], dtype=np.int64)
+    roots = np.array([ordinals[i] for i in tree.root_idx()], dtype=np.int64)
+
+    return TreePlan(child_ptr.astype(np.int64),
+                    child_idx,
+                    parent,
+                    np.array(input_rows, dtype=np.int64),
+                    roots,
+                    np.zeros(roots.shape[0], dtype=np.int64),
+                    _longest_paths(children),
+                    _longest_paths(parents),
+                    [len(positions)],
+                    num_inputs)
+
+
+def compile_parent_plan(parent, input_rows, num_inputs):
+    """Compile a tree given as a parent array into a TreePlan
+
+    Parameters
+    ----------
+    parent : numpy.array(int)
+        the parent of each node (-1 for roots); every node must come
+        after its parent, as in preorder
+    input_rows : numpy.array(int)
+        the row of the inputs corresponding to each node (-1 if the
+        node does not have an input)
+    num_inputs : int
+        the number of inputs the tree consumes
+
+    Returns
+    -------
+    TreePlan
+    """
+    parent = np.asarray(parent, dtype=np.int64)
+    num_nodes = parent.shape[0]
+
+    if np.any(parent >= np.arange(num_nodes)):
+        raise ValueError('every node must come after its parent')
+
+    has_parent = parent >= 0
+    child_nodes = np.flatnonzero(has_parent)
+    child_parents = parent[has_parent]
+
+    # stable, so that children stay in node order
+    child_idx = child_nodes[np.argsort(child_parents, kind='stable')]
+    child_ptr = np.concatenate([[0], np.cumsum(np.bincount(child_parents,
+                                                           minlength=num_nodes))])
+
+    parent_list = parent.tolist()
+    depth = [0] * num_nodes
+    height = [0] * num_nodes
+
+    for k, p in enumerate(parent_list):
+        if p >= 0:
+            depth[k] = depth[p] + 1
+
+    for k in reversed(range(num_nodes)):
+        p = parent_list[k]
+
+        if p >= 0 and height[p] < height[k] + 1:
+            height[p] = height[k] + 1
+
+    roots = np.flatnonzero(~has_parent)
+
+    return TreePlan(child_ptr.astype(np.int64),
+                    child_idx,
+                    parent,
+                    np.asarray(input_rows, dtype=np.int64),
+                    roots,
+                    np.zeros(roots.shape[0], dtype=np.int64),
+                    np.array(height, dtype=np.int64),
+                    np.array(depth, dtype=np.int64),
+                    [num_nodes],
+                    num_inputs)
+
+
+class TreePlanCache(object):
+    """A bounded LRU cache of compiled tree plans
+
+    Plans are keyed by tree identity (or, for forests, by the identity
+    of each tree, in order), so a tree must not be modified after its
+    plan has been cached (or the cache must be cleared). A reference
+    to each cached tree is held, so that its id cannot be reused by
+    another object while its plan is in the cache.
+
+    Parameters
+    ----------
+    maxsize : int or NoneType
+        the maximum number of plans to keep; None means unbounded
+    """
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+
+        self._plans = OrderedDict()
+
+    def get(self, tree, compile_plan):
+        """Get the plan for tree, compiling it on a miss
+
+        Parameters
+        ----------
+        tree : object
+        compile_plan : callable
+            maps tree to its TreePlan
+        """
+        return self._get(id(tree), (tree,), lambda: compile_plan(tree))
+
+    def get_forest(self, trees, compile_plan):
+        """Get the plan for a forest of trees, compiling it on a miss
+
+        The same trees in the same order hit the same plan, so the
+        levels of a minibatch that recurs (e.g. every epoch) are only
+        built once.
+
+        Parameters
+        ----------
+        trees : list(object)
+        compile_plan : callable
+            maps trees to their TreePlan
+        """
+        trees = tuple(trees)
+
+        return self._get(tuple(map(id, trees)), trees,
+                         lambda: compile_plan(trees))
+
+    def _get(self, key, trees, compile_plan):
+        if key in self._plans and\
+           all(a is b for a, b in zip(self._plans[key][0], trees)):
+            self.hits += 1
+            self._plans.move_to_end(key)
+
+            return self._plans[key][1]
+
+        self.misses += 1
+
+        plan = compile_plan()
+
+        if self.maxsize is None or self.maxsize > 0:
+            self._plans[key] = (trees, plan)
+            self._plans.move_to_end(key)
+
+            if self.maxsize is not None and len(self._plans) > self.maxsize:
+                self._plans.popitem(last=False)
+
+        return plan
+
+    def cache_info(self):
+        return CacheInfo(self.hits, self.misses,
+                         self.maxsize, len(self._plans))
+
+    def cache_clear(self):
+        self.hits = 0
+        self.misses = 0
+        self._plans.clear()
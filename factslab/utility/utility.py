@@ -2,46 +2,246 @@ import os
 import numpy as np
 import pandas as pd
 
+from collections import deque
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor
 from zipfile import ZipFile
 
 
-def load_glove_embedding(fpath, vocab):
+def load_glove_embedding(fpath, vocab, cache_dir=None, cache=True,
+                         processes=1):
     """load glove embedding
 
+    The first time a GloVe embedding is loaded, the whole embedding
+    is converted into a binary float32 matrix (NAME.bin) and a vocab
+    file with one word per line (NAME.vocab) in cache_dir. Every load
+    then memory-maps the matrix and gathers the rows for vocab, so no
+    text is parsed after the first load.
+
+    If cache is False, no files are written; the zip is streamed
+    instead and only the rows for vocab are kept.
+
     Parameters
     ----------
     fpath : str
         path to zip containing glove embeddings
     vocab : list(str)
         list of vocab elements to extract from glove
+    cache_dir : str or NoneType
+        directory for the binary cache (default: the working
+        directory)
+    cache : bool
+        whether to build and use the binary cache
+    processes : int
+        number of processes parsing the zip when it is read
+
+    Returns
+    -------
+    pandas.DataFrame
+        the embeddings of the vocab elements found in glove, followed
+        by the mean of those embeddings for each vocab element that
+        was not found
+    """
+
+    if cache:
+        matrix, words, index = open_glove_cache(fpath, cache_dir,
+                                                processes)
+
+        # keep the order of the glove file
+        rows = np.array(sorted({index[w] for w in vocab if w in index}),
+                        dtype=np.int64)
+
+        found = [words[r] for r in rows]
+        matrix = matrix[rows]
+    else:
+        _, dim = _glove_name(fpath)
+        chunks = list(iter_glove(fpath, vocab=vocab, processes=processes))
+
+        found = [w.decode('utf-8', 'surrogateescape')
+                 for words, _ in chunks for w in words]
+        matrix = np.concatenate([np.empty((0, dim), dtype=np.float32)] +
+                                [m for _, m in chunks])
+
+    embedding = pd.DataFrame(np.asarray(matrix, dtype=float), index=found)
+
+    mean_emb = list(embedding.mean(axis=0).values)
+    found = set(found)
+    oov = [w for w in vocab if w not in found]
+    oov = pd.DataFrame(np.tile(mean_emb, [len(oov), 1]), index=oov)
+
+    embedding = pd.concat([embedding, oov], axis=0)
+
+    return embedding
+
+
+def open_glove_cache(fpath, cache_dir=None, processes=1):
+    """memory-map the binary cache of a glove embedding
+
+    The cache is built from the zip first if it does not exist yet.
+
+    Parameters
+    ----------
+    fpath : str
+        path to zip containing glove embeddings (without .zip)
+    cache_dir : str or NoneType
+        directory for the binary cache (default: the working
+        directory)
+    processes : int
+        number of processes parsing the zip if the cache is built
+
+    Returns
+    -------
+    matrix : numpy.memmap
+        a read-only words-by-dimension float32 matrix
+    words : list(str)
+        the word of each row of matrix
+    index : dict(str, int)
+        the row of each word
+    """
+
+    name, dim = _glove_name(fpath)
+
+    cache_dir = os.getcwd() if cache_dir is None else cache_dir
+    binpath = os.path.join(cache_dir, name + '.bin')
+    vocabpath = os.path.join(cache_dir, name + '.vocab')
+
+    if not (os.path.exists(binpath) and os.path.exists(vocabpath)):
+        _convert_glove(fpath, binpath, vocabpath, processes)
+
+    with open(vocabpath, encoding='utf-8', errors='surrogateescape') as f:
+        words = f.read().split('\n')[:-1]
+
+    index = {w: i for i, w in enumerate(words)}
+
+    matrix = np.memmap(binpath, dtype=np.float32, mode='r',
+                       shape=(len(words), dim))
+
+    return matrix, words, index
+
+
+def iter_glove(fpath, vocab=None, processes=1, chunk_size=2**24):
+    """stream the embeddings in a glove zip chunk by chunk
+
+    The text is read in blocks of about chunk_size bytes, and the
+    numbers in each block are parsed in one call to numpy, optionally
+    in a pool of processes. At most two blocks per process are in
+    flight at once, so memory use depends on chunk_size and processes
+    but not on the size of the embedding.
+
+    Parameters
+    ----------
+    fpath : str
+        path to zip containing glove embeddings (without .zip)
+    vocab : iterable(str) or NoneType
+        if given, only the embeddings of these words are kept
+    processes : int
+        number of processes parsing blocks (1 parses in this process)
+    chunk_size : int
+        number of bytes read at once
+
+    Yields
+    ------
+    words : list(bytes)
+        the utf-8 encoded words of the block, in file order
+    matrix : numpy.array
+        the words-by-dimension float32 embeddings of the block
     """
 
+    name, dim = _glove_name(fpath)
+
+    if vocab is not None:
+        vocab = {w.encode('utf-8', 'surrogateescape') for w in vocab}
+
+    with ZipFile(fpath + '.zip') as z, z.open(name + '.txt') as f:
+        blocks = _read_blocks(f, chunk_size)
+
+        if processes == 1:
+            for block in blocks:
+                yield _parse_glove_block(block, dim, vocab)
+
+            return
+
+        with ProcessPoolExecutor(processes) as pool:
+            pending = deque()
+
+            for block in blocks:
+                pending.append(pool.submit(_parse_glove_block,
+                                           block, dim, vocab))
+
+                if len(pending) == 2 * processes:
+                    yield pending.popleft().result()
+
+            while pending:
+                yield pending.popleft().result()
+
+
+def _glove_name(fpath):
     zipname = os.path.split(fpath)[-1]
     size, dim = zipname.split('.')[1:3]
-    fpathout = 'glove.' + size + '.' + dim + '.filtered.txt'
 
-    if fpathout in os.listdir(os.getcwd()):
-        embedding = pd.read_csv(fpathout, index_col=0, header=None, sep=' ')
+    return 'glove.' + size + '.' + dim, int(dim.rstrip('d'))
 
-    else:
-        fname = 'glove.' + size + '.' + dim + '.txt'
-        f_emb = ZipFile(fpath + '.zip').open(fname)
 
-        emb = np.array([l.decode().strip().split()
-                        for l in f_emb
-                        if l.split()[0].decode() in vocab])
+def _read_blocks(f, chunk_size):
+    """read a binary file in blocks of whole lines"""
+    rest = b''
 
-        embedding = pd.DataFrame(emb[:, 1:].astype(float), index=emb[:, 0])
+    while True:
+        chunk = f.read(chunk_size)
 
-        mean_emb = list(embedding.mean(axis=0).values)
-        oov = [w for w in vocab if w not in embedding.index.values]
-        oov = pd.DataFrame(np.tile(mean_emb, [len(oov), 1]), index=oov)
+        if not chunk:
+            break
 
-        embedding = pd.concat([embedding, oov], axis=0)
+        block, _, rest = (rest + chunk).rpartition(b'\n')
 
-        embedding.to_csv(fpathout, sep=' ', header=False)
+        if block:
+            yield block
 
-    return embedding
+    if rest.strip():
+        yield rest
+
+
+def _parse_glove_block(block, dim, vocab=None):
+    words, numbers = [], []
+
+    for line in block.split(b'\n'):
+        line = line.rstrip()
+
+        if not line:
+            continue
+
+        if line.count(b' ') == dim:
+            word, _, vector = line.partition(b' ')
+        else:
+            # some glove words contain spaces, so count from the end
+            fields = line.rsplit(b' ', dim)
+            word, vector = fields[0], b' '.join(fields[1:])
+
+        if vocab is None or word in vocab:
+            words.append(word)
+            numbers.append(vector)
+
+    matrix = np.fromstring(b'\n'.join(numbers), dtype=np.float32, sep=' ')
+
+    if matrix.shape[0] != len(words) * dim:
+        msg = 'malformed glove line near: ' + repr(block[:50])
+        raise ValueError(msg)
+
+    return words, matrix.reshape(len(words), dim)
+
+
+def _convert_glove(fpath, binpath, vocabpath, processes=1):
+    # write to temporary files and move them into place at the end,
+    # so that an interrupted conversion is never mistaken for a cache
+    tmpbin, tmpvocab = binpath + '.tmp', vocabpath + '.tmp'
+
+    with open(tmpbin, 'wb') as f_bin, open(tmpvocab, 'wb') as f_vocab:
+        for words, matrix in iter_glove(fpath, processes=processes):
+            f_vocab.writelines([w + b'\n' for w in words])
+            f_bin.write(matrix.tobytes())
+
+    os.replace(tmpbin, binpath)
+    os.replace(tmpvocab, vocabpath)
 
 
 def partition(l, n):
@@ -52,3 +252,134 @@ def partition(l, n):
             yield l[i:(i + n)]
         else:
             yield l[i:]
+
+
+def chunked(iterable, n):
+    """lazily split an iterable into lists of n elements
+
+    Unlike partition, iterable can be any iterable, including a
+    generator, and only one block is held at a time.
+    """
+
+    iterator = iter(iterable)
+    block = list(islice(iterator, n))
+
+    while block:
+        yield block
+        block = list(islice(iterator, n))
+
+
+def save_shards(chunks, prefix, fmt='npy'):
+    """write each of a stream of arrays to its own file
+
+    Shard i is written to PREFIX-0000i.npy (or .parquet) as soon as it
+    is produced, so the stream is never held in memory at once.
+
+    Parameters
+    ----------
+    chunks : iterable(numpy.array)
+        one or two dimensional arrays (e.g. from
+        RNNRegressionTrainer.predict_iter)
+    prefix : str
+        the path of the shards, without the shard number
+    fmt : str
+        'npy' or 'parquet'; parquet requires pyarrow or fastparquet
+
+    Returns
+    -------
+    list(str)
+        the paths of the shards
+    """
+
+    if fmt not in ['npy', 'parquet']:
+        msg = 'fmt must be "npy" or "parquet"'
+        raise ValueError(msg)
+
+    paths = []
+
+    for i, chunk in enumerate(chunks):
+        path = '{}-{:05d}.{}'.format(prefix, i, fmt)
+
+        if fmt == 'npy':
+            np.save(path, chunk)
+        else:
+            chunk = chunk.reshape(chunk.shape[0], -1)
+            columns = [str(j) for j in range(chunk.shape[1])]
+            pd.DataFrame(chunk, columns=columns).to_parquet(path)
+
+        paths.append(path)
+
+    return paths
+
+
+def ridit(scores, groups=None):
+    """ridit scores of ordinal responses, within each group
+
+    Each score is replaced by its average rank within its group
+    divided by the number of scores in the group plus one, so ridit
+    scores lie strictly between 0 and 1. The ranks and counts are
+    computed by pandas for all groups at once, without calling back
+    into Python per group.
+
+    Parameters
+    ----------
+    scores : pandas.Series
+        the responses
+    groups : pandas.Series, numpy.array, or NoneType
+        the group (e.g. participant) of each response, aligned with
+        scores; all responses form one group if None
+
+    Returns
+    -------
+    pandas.Series
+        aligned with scores
+    """
+    if groups is None:
+        return scores.rank() / (scores.count() + 1.)
+
+    grouped = scores.groupby(groups)
+
+    return grouped.rank() / (grouped.transform('count') + 1.)
+
+
+def logit_ridit(scores, groups=None):
+    """log-odds of the ridit scores of ordinal responses
+
+    Parameters
+    ----------
+    scores : pandas.Series
+        the responses
+    groups : pandas.Series, numpy.array, or NoneType
+        as for ridit
+
+    Returns
+    -------
+    pandas.Series
+        aligned with scores
+    """
+    r = ridit(scores, groups)
+
+    return np.log(r) - np.log(1. - r)
+
+
+def zscore(scores, groups=None):
+    """standardize responses within each group
+
+    Parameters
+    ----------
+    scores : pandas.Series
+        the responses
+    groups : pandas.Series, numpy.array, or NoneType
+        as for ridit
+
+    Returns
+    -------
+    pandas.Series
+        aligned with scores; NaN for groups with a single response
+    """
+    if groups is None:
+        return (scores - scores.mean()) / scores.std()
+
+    grouped = scores.groupby(groups)
+
+    return (scores - grouped.transform('mean')) / grouped.transform('std')
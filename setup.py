@@ -7,11 +7,13 @@ setup(name='FACTS.lab',
       author='Aaron Steven White',
       author_email='aaron.white@rochester.edu',
       license='MIT',
-      packages=['factslab', 'factslab.pytorch'],
+      packages=['factslab', 'factslab.datastructures',
+                'factslab.pytorch', 'factslab.utility'],
       install_requires=['numpy',
                         'scipy',
                         'pandas',
                         'torch',
+                        'nltk',
                         'patsy'],
       test_suite='nose.collector',
       tests_require=['nose'],
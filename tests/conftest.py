@@ -0,0 +1,46 @@
+import numpy as np
+import pandas as pd
+import pytest
+from factslab.datastructures import DependencyTree
+from factslab.pytorch.childsumtreelstm import ChildSumDependencyTreeLSTM
+from factslab.pytorch.rnnregression import RNNRegressionTrainer
+
+
+@pytest.fixture
+def embeddings():
+    """Random 5-dimensional embeddings of the words a, b, c, and d"""
+    return pd.DataFrame(np.random.RandomState(0).randn(4, 5),
+                        index=['a', 'b', 'c', 'd'])
+
+
+@pytest.fixture
+def make_tree():
+    """A factory of new dependency trees over the words of embeddings
+
+    make_tree(shape) builds a new tree of one of three shapes: 0 is
+    d(a(b, c)), 1 is a(b(c)), and 2 is c(a, d).
+    """
+    def make_tree(shape=0):
+        if shape == 0:
+            return DependencyTree('d', [DependencyTree('a', ['b', 'c'])])
+        elif shape == 1:
+            return DependencyTree('a', [DependencyTree('b', ['c'])])
+        else:
+            return DependencyTree('c', ['a', 'd'])
+
+    return make_tree
+
+
+@pytest.fixture
+def make_trainer(embeddings):
+    """A factory of dependency tree LSTM regression trainers
+
+    make_trainer(epochs) builds a trainer over embeddings with hidden
+    states of size 5.
+    """
+    def make_trainer(epochs=2):
+        return RNNRegressionTrainer(embeddings=embeddings,
+                                    rnn_classes=ChildSumDependencyTreeLSTM,
+                                    rnn_hidden_sizes=5, epochs=epochs)
+
+    return make_trainer
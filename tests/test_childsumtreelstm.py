@@ -0,0 +1,236 @@
+import pytest
+import torch
+import torch.nn.functional as F
+from factslab.datastructures import CompactTree, ConstituencyTree
+from factslab.datastructures import DependencyTree
+from factslab.pytorch.childsumtreelstm import ChildSumConstituencyTreeLSTM
+from factslab.pytorch.childsumtreelstm import ChildSumDependencyTreeLSTM
+
+
+def reference(lstm, inputs, tree):
+    """The recursive, node-at-a-time computation of the original
+    implementation, on one tree"""
+    def x_0(idx):
+        if isinstance(lstm, ChildSumDependencyTreeLSTM):
+            return inputs[tree.word_index(idx)]
+        elif idx in tree.terminal_indices:
+            return inputs[tree.terminal_indices.index(idx)]
+        else:
+            return inputs.new_zeros(lstm.input_size)
+
+    def run(layer, direction, x, idx, states):
+        if idx in states:
+            return states[idx]
+
+        if direction == 'up':
+            previous = tree.children_idx(idx)
+        else:
+            previous = tree.parents_idx(idx)
+
+        if previous:
+            h_prev, c_prev = zip(*[run(layer, direction, x, i, states)
+                                   for i in previous])
+            h_prev = torch.stack(h_prev, 1)
+            c_prev = torch.stack(c_prev, 1)
+        else:
+            h_prev = inputs.new_zeros(lstm.hidden_size, 1)
+            c_prev = inputs.new_zeros(lstm.hidden_size, 1)
+
+        Wih, Whh, bih, bhh = lstm._get_parameters(layer, direction)
+
+        fcio = torch.matmul(Whh, h_prev) +\
+            torch.matmul(Wih, x[idx][:, None]) + bhh[:, None] + bih[:, None]
+        f, c_hat, i, o = torch.split(fcio, lstm.hidden_size, dim=0)
+
+        c = torch.sum(F.sigmoid(f) * c_prev, 1) +\
+            F.sigmoid(i.sum(1)) * torch.tanh(c_hat.sum(1))
+        h = F.sigmoid(o.sum(1)) * torch.tanh(c)
+
+        states[idx] = (h, c)
+
+        return h, c
+
+    x = {idx: x_0(idx) for idx in tree.positions}
+
+    for layer in range(lstm.num_layers):
+        up, down = {}, {}
+
+        for idx in tree.positions:
+            run(layer, 'up', x, idx, up)
+
+            if lstm.bidirectional:
+                run(layer, 'down', x, idx, down)
+
+        if lstm.bidirectional:
+            x = {idx: torch.cat([up[idx][0], down[idx][0]])
+                 for idx in tree.positions}
+        else:
+            x = {idx: up[idx][0] for idx in tree.positions}
+
+    hidden_all = torch.stack([x[idx] for idx in tree.positions])
+
+    return hidden_all, hidden_all[0]
+
+
+def dependency_trees():
+    g = DependencyTree('g', ['h'])
+
+    return [DependencyTree('a', ['b']),
+            DependencyTree('a', [DependencyTree('b', ['c', 'd']), 'e',
+                                 DependencyTree('f', [g])]),
+            DependencyTree('a', [])]
+
+
+def constituency_trees():
+    return [ConstituencyTree.fromstring('(S (NP a) (VP b (NP c d)))'),
+            ConstituencyTree.fromstring('(S (A (B (C a))) b)')]
+
+
+def deep_tree(depth):
+    """A chain of depth nodes, deeper than the recursion limit"""
+    tree = 'w0'
+
+    for k in range(1, depth):
+        tree = DependencyTree('w' + str(k), [tree])
+
+    return tree
+
+
+def outputs_and_gradients(lstm, inputs, tree, run=None):
+    inputs = inputs.clone().requires_grad_()
+    lstm.zero_grad()
+
+    if run is None:
+        hidden_all, hidden_final = lstm(inputs, tree)
+    else:
+        hidden_all, hidden_final = run(lstm, inputs, tree)
+
+    (hidden_all.sum() + hidden_final.sum()).backward()
+
+    # a parameter that only meets zero states gets no gradient at all
+    gradients = [torch.zeros_like(p) if p.grad is None else p.grad.clone()
+                 for p in lstm.parameters()]
+
+    return [hidden_all.detach(), hidden_final.detach(), inputs.grad] +\
+        gradients
+
+
+def assert_all_close(expected, actual):
+    for e, a in zip(expected, actual):
+        assert torch.allclose(e, a, atol=1e-5)
+
+
+@pytest.mark.parametrize('lstm_class, trees', [
+    (ChildSumDependencyTreeLSTM, dependency_trees()),
+    (ChildSumConstituencyTreeLSTM, constituency_trees())])
+def test_execution_modes_match_reference(lstm_class, trees):
+    torch.manual_seed(0)
+
+    lstm = lstm_class(input_size=4, hidden_size=3, num_layers=2,
+                      bidirectional=True)
+
+    for tree in trees:
+        inputs = torch.randn(len(tree.words()), 4)
+
+        expected = outputs_and_gradients(lstm, inputs, tree, reference)
+
+        for execution in ['level', 'node']:
+            lstm.execution = execution
+
+            assert_all_close(expected,
+                             outputs_and_gradients(lstm, inputs, tree))
+
+
+def test_execution_modes_match_on_deep_tree():
+    torch.manual_seed(0)
+
+    lstm = ChildSumDependencyTreeLSTM(input_size=4, hidden_size=3,
+                                      bidirectional=True)
+    tree = deep_tree(3000)
+    inputs = torch.randn(len(tree.words()), 4)
+
+    level = outputs_and_gradients(lstm, inputs, tree)
+
+    lstm.execution = 'node'
+
+    assert_all_close(level, outputs_and_gradients(lstm, inputs, tree))
+
+
+@pytest.mark.parametrize('execution', ['level', 'node'])
+def test_forest_matches_trees_run_one_at_a_time(execution):
+    torch.manual_seed(0)
+
+    lstm = ChildSumDependencyTreeLSTM(input_size=4, hidden_size=3,
+                                      num_layers=2, bidirectional=True,
+                                      execution=execution)
+    trees = dependency_trees()
+    inputs = [torch.randn(len(tree.words()), 4, requires_grad=True)
+              for tree in trees]
+
+    hidden_all, hidden_final = lstm(torch.cat(inputs), trees)
+    (sum([h.sum() for h in hidden_all]) + hidden_final.sum()).backward()
+
+    forest = [p.grad.clone() for p in lstm.parameters()] +\
+        [x.grad.clone() for x in inputs]
+
+    lstm.zero_grad()
+
+    for x in inputs:
+        x.grad = None
+
+    for k, (tree, x) in enumerate(zip(trees, inputs)):
+        tree_all, tree_final = lstm(x, tree)
+        (tree_all.sum() + tree_final.sum()).backward()
+
+        assert torch.allclose(hidden_all[k], tree_all, atol=1e-5)
+        assert torch.allclose(hidden_final[k], tree_final, atol=1e-5)
+
+    one_at_a_time = [p.grad for p in lstm.parameters()] +\
+        [x.grad for x in inputs]
+
+    assert_all_close(forest, one_at_a_time)
+
+
+def test_forests_are_only_cached_on_request_in_training():
+    lstm = ChildSumDependencyTreeLSTM(input_size=4, hidden_size=3)
+    trees = dependency_trees()
+    inputs = torch.randn(sum([len(t.words()) for t in trees]), 4)
+
+    lstm(inputs, trees)
+    assert lstm.forest_cache_info().currsize == 0
+
+    lstm.cache_forests(2)
+    lstm(inputs, trees)
+    lstm(inputs, list(trees))
+    assert lstm.forest_cache_info()[:2] == (1, 1)
+
+    lstm.eval()
+    lstm(inputs, trees)
+    assert lstm.forest_cache_info()[:2] == (1, 1)
+
+    lstm.cache_forests(0)
+    assert lstm.forest_cache_info().currsize == 0
+
+
+@pytest.mark.parametrize('lstm_class, trees', [
+    (ChildSumDependencyTreeLSTM, dependency_trees()),
+    (ChildSumConstituencyTreeLSTM, constituency_trees())])
+def test_compact_tree_matches_nltk_tree(lstm_class, trees):
+    torch.manual_seed(0)
+
+    lstm = lstm_class(input_size=4, hidden_size=3, num_layers=2,
+                      bidirectional=True)
+
+    for tree in trees:
+        compact = CompactTree.from_tree(tree)
+
+        # the two kinds of tree may list their words in different
+        # orders, so each word gets its own input
+        embedding = {w: torch.randn(4) for w in tree.words()}
+
+        expected = lstm(torch.stack([embedding[w] for w in tree.words()]),
+                        tree)
+        actual = lstm(torch.stack([embedding[w]
+                                   for w in compact.words()]), compact)
+
+        assert_all_close(expected, actual)
@@ -0,0 +1,17 @@
+import pytest
+from factslab.pytorch.dataset import prefetch
+
+
+def interrupted():
+    yield 0
+    raise KeyboardInterrupt
+
+
+def test_prefetch_raises_base_exceptions_of_producer():
+    items = []
+
+    with pytest.raises(KeyboardInterrupt):
+        for item in prefetch(interrupted()):
+            items.append(item)
+
+    assert items == [0]
@@ -0,0 +1,96 @@
+import gc
+import random
+import weakref
+import torch
+from factslab.pytorch.childsumtreelstm import ChildSumDependencyTreeLSTM
+from factslab.pytorch.rnnregression import RNNRegression
+
+
+def test_training_after_inference_on_same_tree(make_tree):
+    torch.manual_seed(0)
+
+    lstm = ChildSumDependencyTreeLSTM(input_size=5, hidden_size=5,
+                                      execution='level')
+    tree = make_tree()
+    inputs = torch.randn(len(tree.words()), 5)
+
+    # the plan of tree is compiled and cached in inference mode
+    with torch.inference_mode():
+        lstm(inputs, tree)
+
+    lstm(inputs, tree)[1].sum().backward()
+
+    assert lstm.weight_ih_l0.grad is not None
+
+
+def test_fit_after_validation_on_same_tree(make_tree, make_trainer):
+    # with this seed, the batch [t0, t1] comes first, so t2 is
+    # validated alone before it is trained on alone
+    random.seed(0)
+    torch.manual_seed(0)
+
+    t0, t1, t2 = make_tree(1), make_tree(2), make_tree()
+
+    trainer = make_trainer(epochs=2)
+    trainer.fit([[t0, t1], [t2]], [[.1, .2], [.3]], verbosity=0,
+                validation=([t2], [.3]), eval_every=1)
+
+    assert len(trainer.validation_losses) == 4
+
+
+def test_predict_iter_frees_the_trees_of_earlier_chunks(make_tree,
+                                                        make_trainer):
+    torch.manual_seed(0)
+
+    trainer = make_trainer(epochs=1)
+    trainer.fit([[make_tree()]], [[.1]], verbosity=0)
+
+    lstm = trainer._regression.rnns[0]
+    refs = []
+
+    def stream(n):
+        for _ in range(n):
+            tree = make_tree()
+            refs.append(weakref.ref(tree))
+
+            yield tree
+
+    # more trees than the per-tree plan cache holds
+    n = lstm.plan_cache_info().maxsize + 500
+
+    for predicted in trainer.predict_iter(stream(n), chunk_size=100,
+                                          batch_size=10):
+        pass
+
+    gc.collect()
+
+    assert lstm.forest_cache_info().currsize == 0
+    assert all(ref() is None for ref in refs[:100])
+    assert sum(ref() is not None for ref in refs) <=\
+        lstm.plan_cache_info().maxsize
+
+
+def test_masked_attention_ignores_padding_and_batch_size(embeddings):
+    torch.manual_seed(0)
+
+    regression = RNNRegression(embeddings=embeddings, rnn_hidden_sizes=5,
+                               attention=True)
+    torch.nn.init.normal_(regression.attention_map)
+    regression.eval()
+
+    sentences = [['a', 'b', 'c', 'd'], ['c'], ['d', 'a']]
+
+    with torch.no_grad():
+        h_all, _, lengths, _, _ = regression._encode(sentences)
+        weights = regression._run_attention(h_all, lengths,
+                                            return_weights=True)
+
+        predicted, _ = regression(sentences)
+        one_at_a_time = [regression([s])[0] for s in sentences]
+
+    for w, n in zip(weights, lengths.tolist()):
+        assert torch.all(w[n:] == 0)
+        assert torch.isclose(w[:n].sum(), torch.tensor(1.))
+
+    for p, q in zip(predicted, one_at_a_time):
+        assert torch.allclose(p, q, atol=1e-6)
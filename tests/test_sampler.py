@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+from factslab.pytorch.sampler import BucketBatchSampler
+
+
+def test_restored_sampler_draws_the_same_batches():
+    lengths = np.random.RandomState(0).randint(1, 20, size=200)
+
+    sampler = BucketBatchSampler(lengths, max_tokens=64, seed=0)
+    list(sampler)
+
+    state = sampler.state_dict()
+    expected = [list(sampler) for _ in range(2)]
+
+    restored = BucketBatchSampler(lengths, max_tokens=64, seed=1)
+    restored.load_state_dict(state)
+
+    for batches, restored_batches in zip(expected,
+                                         [list(restored) for _ in range(2)]):
+        assert len(batches) == len(restored_batches)
+        assert all(np.array_equal(a, b)
+                   for a, b in zip(batches, restored_batches))
+
+
+@pytest.mark.parametrize('max_tokens', [1, 16, 64, 100])
+def test_batches_stay_within_the_token_budget(max_tokens):
+    lengths = np.random.RandomState(0).randint(1, 40, size=500)
+
+    sampler = BucketBatchSampler(lengths, max_tokens=max_tokens, seed=0)
+    batches = list(sampler)
+
+    # every sequence is in exactly one batch
+    assert sorted(np.concatenate(batches).tolist()) == list(range(500))
+
+    for batch in batches:
+        padded = len(batch) * lengths[batch].max()
+
+        assert padded <= max_tokens or len(batch) == 1
@@ -0,0 +1,63 @@
+import random
+import numpy as np
+import torch
+
+
+def test_distributed_fit_keeps_validation_losses(make_tree, make_trainer):
+    torch.manual_seed(0)
+
+    t0, t1 = make_tree(1), make_tree(2)
+    trainer = make_trainer()
+
+    # two steps per process per epoch
+    trainer.fit([[t0], [t1], [t0, t1], [t1]], [[.1], [.2], [.1, .2], [.2]],
+                verbosity=0, workers=2, validation=([t0, t1], [.1, .2]),
+                eval_every=1)
+
+    assert len(trainer.validation_losses) == 4
+    assert np.isclose(trainer.evaluate([t0, t1], [.1, .2]),
+                      min(trainer.validation_losses))
+
+
+def test_resume_from_checkpoint_with_sampler(tmpdir, make_tree,
+                                            make_trainer):
+    t0, t1 = make_tree(1), make_tree(2)
+    X, Y = [t0, t1, t1, t0], [.1, .2, .2, .1]
+
+    # one tree per batch, so four steps per epoch
+    random.seed(0)
+    torch.manual_seed(0)
+
+    trainer = make_trainer(epochs=2)
+    trainer.fit(X, Y, verbosity=0, max_tokens=4,
+                checkpoint_dir=str(tmpdir), checkpoint_every=1,
+                keep_checkpoints=8)
+
+    # from the middle of the first epoch, so the sampler draws the
+    # second epoch after resuming
+    random.seed(1)
+    torch.manual_seed(1)
+
+    resumed = make_trainer(epochs=2)
+    resumed.fit(X, Y, verbosity=0, max_tokens=4,
+                resume_from=str(tmpdir.join('checkpoint-000000002.pt')))
+
+    expected = trainer._regression.state_dict()
+
+    for name, tensor in resumed._regression.state_dict().items():
+        assert torch.allclose(tensor, expected[name])
+
+
+def test_validation_loss_is_only_printed_with_verbosity(capsys, make_tree,
+                                                        make_trainer):
+    t0, t1 = make_tree(1), make_tree(2)
+
+    for verbosity in [0, 1]:
+        trainer = make_trainer(epochs=1)
+        trainer.fit([[t0], [t1]], [[.1], [.2]], verbosity=verbosity,
+                    validation=([t0, t1], [.1, .2]))
+
+        printed = 'Validation loss' in capsys.readouterr().out
+
+        assert printed == bool(verbosity)
+        assert len(trainer.validation_losses) == 1
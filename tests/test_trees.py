@@ -0,0 +1,60 @@
+import nltk
+import pytest
+from factslab.datastructures import ConstituencyTree, DependencyTree
+
+
+def nltk_children(tree, idx):
+    node = tree[idx] if idx else tree
+
+    if not isinstance(node, nltk.Tree):
+        return []
+
+    return [idx + (i,) for i in range(len(node))]
+
+
+def assert_index_matches_nltk(tree):
+    assert tree.positions == tree.treepositions()
+
+    for idx in tree.positions:
+        assert tree.children_idx(idx) == nltk_children(tree, idx)
+        assert tree.parents_idx(idx) == ([idx[:-1]] if idx else [])
+
+    assert tree.terminal_indices == [tree.leaf_treeposition(i)
+                                     for i in range(len(tree.leaves()))]
+
+
+@pytest.mark.parametrize('tree_class', [ConstituencyTree, DependencyTree])
+def test_index_matches_nltk(tree_class):
+    # the root has fewer children than there are leaves, and nodes at
+    # the same depth under different parents share a first index
+    tree = tree_class.fromstring('(S (NP (D a) (N b)) (VP (V c) '
+                                 '(NP (D d) (A e) (N f))))')
+
+    assert_index_matches_nltk(tree)
+
+
+def test_constituency_children_are_only_direct_children():
+    tree = ConstituencyTree.fromstring('(S (NP a b) (VP c))')
+
+    assert tree.children_idx((0,)) == [(0, 0), (0, 1)]
+    assert tree.children_idx((1,)) == [(1, 0)]
+
+
+def test_dependency_children_check_the_full_prefix():
+    c = DependencyTree('c', ['d'])
+    tree = DependencyTree('a', [DependencyTree('b', [c, 'e']),
+                                DependencyTree('f', ['g'])])
+
+    assert tree.children_idx((0, 0)) == [(0, 0, 0)]
+    assert tree.children_idx((1,)) == [(1, 0)]
+
+
+def test_index_is_rebuilt_after_modification():
+    tree = ConstituencyTree.fromstring('(S (X (Y a b)) c)')
+    tree.positions
+
+    tree.collapse_unary(True, True)
+    assert_index_matches_nltk(tree)
+
+    tree.append('d')
+    assert_index_matches_nltk(tree)
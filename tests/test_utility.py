@@ -0,0 +1,108 @@
+import csv
+import os
+import numpy as np
+import pandas as pd
+import pytest
+from zipfile import ZipFile
+from factslab.utility import ridit, logit_ridit, zscore
+from factslab.utility import load_glove_embedding
+
+
+def make_data():
+    rng = np.random.RandomState(0)
+
+    # an index out of order, so that results must align by label
+    return pd.DataFrame({'participant': rng.randint(20, size=500),
+                         'response': rng.randint(1, 8, size=500)},
+                        index=rng.permutation(500) + 1000)
+
+
+def callback_ridit(scores, groups):
+    return scores.groupby(groups).transform(lambda x: x.rank() /
+                                            (len(x) + 1.))
+
+
+def callback_zscore(scores, groups):
+    return scores.groupby(groups).transform(lambda x: (x - x.mean()) /
+                                            x.std())
+
+
+@pytest.mark.parametrize('transform, callback', [
+    (ridit, callback_ridit),
+    (zscore, callback_zscore)])
+def test_grouped_transform_matches_callback(transform, callback):
+    data = make_data()
+
+    expected = callback(data.response, data.participant)
+    actual = transform(data.response, data.participant)
+
+    pd.testing.assert_series_equal(actual, expected, check_names=False)
+
+
+def test_logit_ridit_is_log_odds_of_callback_ridit():
+    data = make_data()
+
+    r = callback_ridit(data.response, data.participant)
+    actual = logit_ridit(data.response, data.participant)
+
+    pd.testing.assert_series_equal(actual, np.log(r / (1. - r)),
+                                   check_names=False)
+
+
+def test_ungrouped_ridit_is_one_group():
+    data = make_data()
+
+    expected = data.response.rank() / (data.shape[0] + 1.)
+
+    pd.testing.assert_series_equal(ridit(data.response), expected)
+
+
+GLOVE = ['the 0.5 -1.25 3.0',
+         'a b 1.0 2.0 -0.75',
+         'caf\u00e9 -2.5 0.25 1.5',
+         'NA 0.0 4.0 -3.5',
+         '<unk> 1.5 1.5 1.5']
+
+
+def write_glove(tmpdir):
+    fpath = os.path.join(str(tmpdir), 'glove.tiny.3d')
+
+    with ZipFile(fpath + '.zip', 'w') as z:
+        z.writestr('glove.tiny.3d.txt', '\n'.join(GLOVE) + '\n')
+
+    with open(fpath + '.txt', 'w', encoding='utf-8') as f:
+        f.write('\n'.join(GLOVE) + '\n')
+
+    return fpath
+
+
+def read_glove(fpath):
+    # the word is everything before the last three numbers
+    return pd.read_csv(fpath + '.txt', sep=r' (?=-?[\d.]+(?: |$))',
+                       engine='python', header=None, index_col=0,
+                       quoting=csv.QUOTE_NONE, keep_default_na=False,
+                       encoding='utf-8')
+
+
+def test_glove_cache_round_trip(tmpdir):
+    fpath = write_glove(tmpdir)
+    cache_dir = str(tmpdir.mkdir('cache'))
+
+    expected = read_glove(fpath)
+    vocab = ['caf\u00e9', 'a b', 'NA', 'missing', 'the']
+
+    cold = load_glove_embedding(fpath, vocab, cache_dir=cache_dir)
+
+    assert os.path.exists(os.path.join(cache_dir, 'glove.tiny.3d.bin'))
+
+    warm = load_glove_embedding(fpath, vocab, cache_dir=cache_dir)
+    streamed = load_glove_embedding(fpath, vocab, cache=False)
+
+    found = [w for w in expected.index if w in vocab]
+
+    for embedding in [cold, warm, streamed]:
+        assert embedding.index.tolist() == found + ['missing']
+        assert np.allclose(embedding.loc[found].values,
+                           expected.loc[found].values)
+        assert np.allclose(embedding.loc['missing'].values,
+                           expected.loc[found].values.mean(axis=0))